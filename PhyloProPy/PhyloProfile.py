@@ -1,10 +1,20 @@
 import pandas as pd
+import numpy as np
 import os
-from ete3 import NCBITaxa
-from PhyloProPy.load_phyloprofile import phyloprofile2matrix, sort_phyloprofile
-from PhyloProPy.plotting_tools import plot_tsne, phylo_heatmap, dimension_reduced_phyloprofile
+from PhyloProPy.load_phyloprofile import phyloprofile2matrix, sort_phyloprofile, outmatrix_to_records, write_phyloprofile, records_to_matrix, records_to_outmatrix, cell_keys, count_orthologs
+from PhyloProPy.plotting_tools import plot_tsne, phylo_heatmap, dimension_reduced_phyloprofile, embedding_grid
 from PhyloProPy.logger import phyloprofile_logger
-from PhyloProPy.mapping import check_taxonomy_input
+from PhyloProPy.mapping import check_taxonomy_input, taxa_to_rank
+from PhyloProPy.profile_stats import gene_statistics, collapse_matrix
+from PhyloProPy.indexing import ProfileIndex, selection
+from PhyloProPy.orthoxml import write_orthoxml
+from PhyloProPy.orthoids import OrthoIDStore, CompactOutmatrix
+from PhyloProPy import arrow
+from PhyloProPy.compare import ProfileDiff, intersect_records, merge_records
+from PhyloProPy.summary import LineageMembership, SummaryEngine
+from PhyloProPy.patterns import PresenceIndex, unique_rows
+from PhyloProPy.scan import scan_phyloprofile
+from PhyloProPy.taxonomy import TaxonomySnapshot, open_taxonomy, taxonomy_path
 import logging
 
 
@@ -16,8 +26,17 @@ class PhyloProfile():
     """
     Parse a PhyloProfile file and store it as a Pandas DataFrame.
     """
+    def __new__(cls, *args, backend='pandas', **kwargs):
+        if backend == 'partitioned' and cls is PhyloProfile:
+            from PhyloProPy.partitioned import PartitionedPhyloProfile
+            return super().__new__(PartitionedPhyloProfile)
+        elif backend not in ['pandas', 'partitioned']:
+            raise ValueError(f'Unknown backend "{backend}". Choose "pandas" or "partitioned"')
+        return super().__new__(cls)
+
     def __init__(
-        self, path='', style='fasf', from_custom=False, fasF_filter=0.0, fasB_filter=0.0, fillna=0, resolve_coorthologs=True, reference='', debug=False, silent=False, 
+        self, path='', style='fasf', from_custom=False, fasF_filter=0.0, fasB_filter=0.0, fillna=0, resolve_coorthologs=True, reference='', threads=1, compact=True, debug=False, silent=False, backend='pandas',
+        progress=None, cancel=None, taxonomy=None,
     ):
         """
         style: ['fasf', 'fasb', 'binary', 'orthoid', 'ncRNA'] -> How to fill cells of phyloprofile matrix, (In case of co-orthologs: Maxmimum FAS-score, List of orthoIDs)
@@ -27,63 +46,139 @@ class PhyloProfile():
         fillna: char -> Fill cells without orthologs with fillna
         resolve_coorthologs: bool -> If True maintain only maximum score, if False fill cells with list of scores
         reference: int/str -> NCBI Taxonomy ID or Species name of the Seed species (of the fDOG analysis). Re-orders the columns of the matrix so that the seed species is left and the most distantly related target species is right.
+        threads: int -> Threads for decompressing gzip/bgzip/zstd compressed phyloprofile files
+        compact: bool -> With style='orthoid', keep the orthoIDs dictionary-encoded in self.orthoids and fill the matrix with integer cell codes (0: no ortholog) instead of lists of strings
         debug: bool -> More verbose
         silent: bool -> Less verbose
+        backend: ['pandas', 'partitioned'] -> 'partitioned' keeps the profile in gene partitions on disk and processes them in parallel (see PartitionedPhyloProfile)
+        progress: callable -> Called with a dict of bytes and records read, throughput and ETA after every block of records and every loading stage (see LoadProgress)
+        cancel: CancelToken -> Cancel the load from another thread or the progress callback. The constructor raises LoadCancelled
+        taxonomy: str -> Path of a taxonomy snapshot (see write_taxonomy) to use instead of the NCBI Taxonomy database, or 'ncbi'. Per default a snapshot saved next to path is used if there is one
         """
         logger = phyloprofile_logger(debug=debug, silent=silent)
-        # taxonomy
-        logger.info('Reading NCBI Taxonomy')
-        self.ncbi = NCBITaxa()
         #data
         if not path:  # load example data
             logger.info('No path specified. Loading example phyloprofile')
             path  = os.path.dirname(__file__) + '/data/medium.phyloprofile'
-        self.matrix, self.outmatrix = phyloprofile2matrix(path, self.ncbi, style, from_custom, fasF_filter, fasB_filter, fillna, resolve_coorthologs, reference)
+        # taxonomy
+        self.ncbi = open_taxonomy(taxonomy, path)
+        self.matrix, self.outmatrix, self.orthoids = phyloprofile2matrix(
+            path, self.ncbi, style, from_custom, fasF_filter, fasB_filter, fillna, resolve_coorthologs, reference, threads=threads, compact=compact,
+            progress=progress, cancel=cancel,
+        )
         self.style = style
+        self._index = None
+        self._summary = None
+        self._presence = None
+
+    @staticmethod
+    def scan(path, from_custom=False, threads=1, sample_mb=None, **kwargs):
+        """
+        Count records, genes, taxa and co-orthologs of a phyloprofile file and project the memory of loading it per style
+        and backend, without loading it. Returns a ProfileScan (see scan_phyloprofile).
+        """
+        return scan_phyloprofile(path, from_custom=from_custom, threads=threads, sample_mb=sample_mb, **kwargs)
+
+    @property
+    def outmatrix(self):
+        """
+        Matrix with lists of (orthoID, FAS_F, FAS_B) tuples of the orthologs in each cell. Compact orthoID profiles decode it
+        from self.orthoids on every access instead of keeping the tuples in memory. None for profiles created from a matrix
+        without ortholog records (from_arrow)
+        """
+        if isinstance(self._outmatrix, CompactOutmatrix):
+            return self._outmatrix.to_frame()
+        return self._outmatrix
+
+    @outmatrix.setter
+    def outmatrix(self, outmatrix):
+        self._outmatrix = outmatrix
+
+    def _map_outmatrix(self, func):
+        """Apply a selection or reordering of genes and taxa to the stored outmatrix, without decoding a compact one"""
+        if isinstance(self._outmatrix, CompactOutmatrix):
+            return self._outmatrix.apply(func)
+        if self._outmatrix is None:
+            return None
+        return func(self._outmatrix)
+
+    def _records(self):
+        """Ortholog records of the profile (geneID, ncbiID, orthoID, FAS_F, FAS_B)"""
+        if isinstance(self._outmatrix, CompactOutmatrix):
+            return self._outmatrix.records()
+        if self._outmatrix is None:
+            raise ValueError('The profile was created from a matrix without ortholog records. Pass the records table to from_arrow (or read_feather) to write or compare its orthologs')
+        return outmatrix_to_records(self._outmatrix)
+
+    def _ortholog_counts(self):
+        """Number of orthologs in each cell of the outmatrix. Without ortholog records, each cell with orthologs counts as one"""
+        if isinstance(self._outmatrix, CompactOutmatrix):
+            return self._outmatrix.counts()
+        if self._outmatrix is None:
+            return (self._numeric_matrix() > 0).astype(np.int64)
+        return pd.DataFrame(count_orthologs(self._outmatrix), index=self._outmatrix.index, columns=self._outmatrix.columns)
+
+    @property
+    def index(self):
+        """Hash index of the gene and taxon labels of the matrix. Rebuilt whenever the labels of the matrix change."""
+        if self._index is None or not self._index.matches(self.matrix):
+            self._index = ProfileIndex(self.matrix.index, self.matrix.columns)
+        return self._index
 
     def to_binary(self):
-        if self.style == 'fasf' or self.style == 'fasb':
-            self.matrix = self.matrix.applymap(lambda x: 1 if x > 0 else 0)
+        if self.style in ['fasf', 'fasb', 'ncRNA']:
+            self.matrix = (self.matrix > 0).astype(np.uint8)
         elif self.style == 'orthoid':
-            self.matrix = self.matrix.astype(str).applymap(lambda x: 0 if x == '0' else 1)
+            self.matrix = self._numeric_matrix()
+            self.orthoids = None
         else:
             self.matrix = self.matrix
-        self.style == 'binary'
-
-    def write_csv(self, path='./output.phyloprofile'):
-        with open(path, 'w') as of:
-            of.write('geneID\tncbiID\torthoID\tFAS_F\tFAS_B\n')
-            for geneid, row in self.outmatrix.iterrows():
-                for taxid, entrylist in row.items():
-                    if entrylist == 0:
-                        continue
-                    for entry in entrylist:
-                        orthoid, fasf, fasb = entry
-                        of.write(f'{geneid}\t{taxid}\t{orthoid}\t{fasf}\t{fasb}\n')
+        self.style = 'binary'
+
+    def orthoid_lists(self, genes=None, taxa=None):
+        """Return a DataFrame slice with lists of orthoIDs in each cell (style 'orthoid')"""
+        if self.style != 'orthoid':
+            raise ValueError(f'Profile was loaded with style "{self.style}". OrthoIDs are only stored with style "orthoid"')
+        df = self.slice(genes, taxa)
+        if self.orthoids is None:
+            return df
+        return self.orthoids.to_lists(df)
+
+    def write_csv(self, path='./output.phyloprofile', compression='infer', threads=1, taxonomy=False):
+        """
+        Write the stored orthologs to a phyloprofile file.
+        compression: ['infer', 'gzip', 'bgzip', 'zstd', None] -> Per default inferred from the suffix of path (.gz, .bgz, .zst)
+        threads: int -> Threads for compression
+        taxonomy: bool -> Also save a taxonomy snapshot of the taxa next to the file, which is used when the file is loaded again
+        """
+        write_phyloprofile(self._records(), path, compression=compression, threads=threads)
+        if taxonomy:
+            self.write_taxonomy(taxonomy_path(path))
+
+    def write_taxonomy(self, path):
+        """
+        Save the lineages, names and ranks of the taxa of the profile to a small taxonomy snapshot file, which can replace the
+        NCBI Taxonomy database when loading the profile, e.g. PhyloProfile(path, taxonomy='profile.taxonomy.tsv.gz')
+        """
+        TaxonomySnapshot.from_ncbi(self.taxa(), self.ncbi).save(path)
 
     def filter_profile(self, genes=None, taxa=None):
         """Filter the the PhyloProfile based on a list of genes or taxids. Irreversible but can be used for writing."""
-        if genes:
-            self.matrix = self.matrix.filter(genes, axis='index')
-            self.outmatrix = self.outmatrix.filter(genes, axis='index')
-        if taxa:
-            taxa = [taxon if str(taxon).startswith('ncbi') else f'ncbi{taxon}' for taxon in taxa]
-            self.matrix = self.matrix.filter(taxa, axis='columns')
-            self.outmatrix = self.outmatrix.filter(taxa, axis='columns')
+        genes, taxa = selection(genes), selection(taxa)
+        if genes is None and taxa is None:
+            return
+        index = self.index
+        self.matrix = index.select(self.matrix, genes, taxa)
+        self.outmatrix = self._map_outmatrix(lambda df: index.select(df, genes, taxa))
 
     def slice(self, genes=None, taxa=None):
-        """Return a DataFrame slice of a PhyloProfile."""
-        if genes:
-            return self.matrix.filter(genes, axis='index')
-        if taxa:
-            taxa = [taxon if str(taxon).startswith('ncbi') else f'ncbi{taxon}' for taxon in taxa]
-            return self.matrix.filter(taxa, axis='columns')
-        return self.matrix
+        """Return a DataFrame slice of a PhyloProfile. Genes and taxa can be combined."""
+        return self.index.select(self.matrix, selection(genes), selection(taxa))
 
     def set_reference(self, reference):
         _, order = sort_phyloprofile(self.matrix, self.ncbi, reference)
         self.matrix = self.matrix[order]
-        self.outmatrix = self.outmatrix[order]
+        self.outmatrix = self._map_outmatrix(lambda df: df[order])
          
     def print(self):
         """Print the phyloenetic profile dataframe"""
@@ -106,11 +201,104 @@ class PhyloProfile():
             return None
      
         descendants = self.ncbi.get_descendant_taxa(input)
-        return self.matrix.filter([f'ncbi{taxid}' for taxid in descendants])
+        return self.index.select(self.matrix, taxa=descendants)
+
+    def gene_stats(self):
+        """Return per-gene statistics: number of taxa with orthologs, number of orthologs and mean and maximum score of the taxa with orthologs"""
+        return gene_statistics(self.matrix, self._ortholog_counts(), numeric=self._numeric())
+
+    def collapse(self, rank='phylum', how='max'):
+        """
+        Return the matrix with taxa collapsed to their ancestor at a taxonomic rank. The profile is not modified.
+        how: ['max', 'mean', 'sum', 'fraction'] -> Aggregate over the taxa of each group. 'fraction' is the fraction of taxa with orthologs
+        """
+        taxid2group = taxa_to_rank(self.taxa(), rank, self.ncbi)
+        return collapse_matrix(self._numeric_matrix(), taxid2group, how)
+
+    def _numeric(self):
+        """Check whether the cells of the matrix hold numbers (and not lists or orthoID codes)"""
+        return self.style != 'orthoid' and all(pd.api.types.is_numeric_dtype(dtype) for dtype in self.matrix.dtypes)
+
+    def _numeric_matrix(self):
+        """Return the matrix as numbers. OrthoID profiles are returned as presence/absence"""
+        if self._numeric():
+            return self.matrix
+        if self.style == 'orthoid' and self.orthoids is not None:
+            return (self.matrix > 0).astype(np.uint8)
+        if self.style == 'orthoid':
+            is_list = np.frompyfunc(lambda x: isinstance(x, list) and len(x) > 0, 1, 1)
+            return pd.DataFrame(is_list(self.matrix.to_numpy()).astype(np.uint8), index=self.matrix.index, columns=self.matrix.columns)
+        raise ValueError('Matrix contains lists of scores. Load the profile with resolve_coorthologs=True')
+
+    @property
+    def summary(self):
+        """
+        Lineage summary engine of the matrix. Rebuilt when the matrix is replaced (e.g. by filter_profile or to_binary),
+        the sparse lineage membership matrix only when the taxa change.
+        """
+        source, engine = self._summary if self._summary is not None else (None, None)
+        if source is not self.matrix:
+            if engine is not None and engine.membership.taxa == list(self.matrix.columns):
+                membership = engine.membership
+            else:
+                membership = LineageMembership(self.matrix.columns, self.ncbi)
+            self._summary = (self.matrix, SummaryEngine(self._numeric_matrix(), membership))
+        return self._summary[1]
+
+    def lineage_stats(self, lineages=None, rank=None, stat='fraction', names=False):
+        """
+        Return per-gene statistics for lineages of the NCBI Taxonomy, e.g. the fraction of Metazoa with an ortholog of each gene.
+        lineages: list -> Lineage names or taxids. Defaults to all lineages of the taxa of the profile
+        rank: str -> Only lineages of this rank, e.g. 'phylum'
+        stat: ['count', 'fraction', 'sum', 'mean'] -> Number or fraction of taxa with orthologs, or sum or mean score over these taxa
+        names: bool -> Label columns with lineage names instead of taxids
+        """
+        engine = self.summary
+        selected = engine.membership.select(lineages, rank)
+        df = engine.stats(list(selected), stat)
+        if names:
+            df.columns = engine.membership.names(selected)
+        return df
 
-    def two_d_plot(self, orient='species', taxlevel='species', update_taxonomy=False, seed=42, jitter=0.0, method='umap', scaler='None', return_as='figure', **kwargs):
+    @property
+    def presence_index(self):
+        """Bit-packed presence index of the matrix with precomputed lineage masks. Rebuilt when the matrix is replaced."""
+        if self._presence is None or self._presence[0] is not self.matrix:
+            self._presence = (self.matrix, PresenceIndex(self._numeric_matrix(), self.summary.membership))
+        return self._presence[1]
+
+    def query(self, present_in=None, absent_from=None, min_fraction=1.0, max_fraction=0.0):
+        """
+        Return the genes with orthologs in a fraction of the taxa of lineages, e.g. Metazoa-specific genes with
+        pp.query(present_in='Metazoa', absent_from=['Fungi', 'Viridiplantae'], min_fraction=0.8).
+        present_in: str/int/list -> Lineage names or taxids in which genes need orthologs in at least min_fraction of the taxa (and at least one)
+        absent_from: str/int/list -> Lineage names or taxids in which genes may have orthologs in at most max_fraction of the taxa
+        """
+        def as_list(lineages):
+            if lineages is None:
+                return []
+            return [lineages] if isinstance(lineages, (str, int, np.integer)) else list(lineages)
+
+        index = self.presence_index
+        present_in, absent_from = as_list(present_in), as_list(absent_from)
+        present_taxids = index.membership.select(present_in)
+        if len(present_taxids) < len(present_in):
+            # a lineage without taxa in the profile cannot contain orthologs
+            return self.matrix.index[:0]
+        return index.query(present_taxids, index.membership.select(absent_from), min_fraction, max_fraction)
+
+    def similar(self, gene, n=10):
+        """Return the n genes whose orthologs are found in the most similar set of taxa (Jaccard similarity) as gene, most similar first"""
+        index = self.presence_index
+        row = index.genes.get_loc(gene)
+        similarity = pd.Series(index.jaccard(row), index=index.genes, name='jaccard').drop(gene)
+        return similarity.nlargest(n)
+
+    def two_d_plot(self, orient='species', taxlevel='species', update_taxonomy=False, seed=42, jitter=0.0, method='umap', scaler='None', return_as='figure', deduplicate=False, decimals=None, **kwargs):
         """
         method: ['umap', 'PCA', 'tSNE', 'MDS']
+        deduplicate: bool -> Reduce only unique profile patterns, weighted by multiplicity for PCA. Identical genes/species share coordinates
+        decimals: int -> Round scores before finding unique patterns
         
         Project phylogenetic profile into 2D space and scatterplot.
         Accepts **kwargs of plotly.express.scatter
@@ -127,9 +315,9 @@ class PhyloProfile():
         # reduce dimension
         logger.info(f'Reducing dimensions')
         red_df = dimension_reduced_phyloprofile(
-            self.matrix, taxlevel, self.ncbi, 
-            update_taxonomy=update_taxonomy, method=method, jitter=jitter, scaler=scaler, transpose=transpose, seed=seed, 
-            **kwargs
+            self._numeric_matrix(), taxlevel, self.ncbi, 
+            update_taxonomy=update_taxonomy, method=method, jitter=jitter, scaler=scaler, transpose=transpose, seed=seed,
+            deduplicate=deduplicate, decimals=decimals, **kwargs
         )
         if return_as == 'dataframe':
             return red_df
@@ -141,29 +329,192 @@ class PhyloProfile():
         else:
             raise ValueError(f'Cannot return result as "{return_as}". Choose "figure" or "dataframe"')
 
-    def plot(self, clustermethod='average', names=True, **kwargs):
-        """Plot phylogenetic profile as simple heatmap."""
+    def embedding_grid(
+        self, orient='species', methods=('umap', 'PCA', 'tSNE', 'MDS'), scalers=('None',), seeds=(42,), taxlevel='species', update_taxonomy=False,
+        jitter=0.0, deduplicate=False, decimals=None, workers=None, threads=1,
+    ):
+        """
+        Compute the 2D projections of all combinations of methods, scalers and seeds in parallel, e.g. to compare them.
+        The matrix is transposed, labelled and scaled only once. Returns a tidy DataFrame with the columns method, scaler, seed,
+        PC1, PC2 and the labels of two_d_plot(return_as='dataframe'), one row per gene/species and projection.
+        methods: list -> Subset of ['umap', 'PCA', 'tSNE', 'MDS']
+        scalers: list -> Subset of ['None', 'StandardScaler', 'RobustScaler', 'QuantileTransformer']
+        workers: int -> Number of worker processes. Defaults to the number of CPUs (at most one per projection)
+        threads: int -> Threads of the numerical libraries (BLAS, OpenMP, numba) in each worker
+        """
+        if orient not in ['species', 'genes']:
+            raise ValueError(f'Unknown orientation "{orient}". Choose "species" or "genes".')
+        return embedding_grid(
+            self._numeric_matrix(), taxlevel, self.ncbi, methods, scalers, seeds, transpose=orient == 'species', update_taxonomy=update_taxonomy,
+            jitter=jitter, deduplicate=deduplicate, decimals=decimals, workers=workers, threads=threads,
+        )
+
+    def plot(self, clustermethod='average', names=True, deduplicate=True, decimals=None, **kwargs):
+        """
+        Plot phylogenetic profile as simple heatmap.
+        deduplicate: bool -> Cluster unique gene patterns weighted by their multiplicity, which is faster. Without tied distances the tree
+            equals that of clustering all genes. Binary profiles have many ties, which are broken differently, so the tree and the gene
+            order can differ (equally valid). Set to False to reproduce scipy's clustering of all genes
+        decimals: int -> Round scores before finding unique patterns
+        """
+        matrix = self._numeric_matrix()
         if names:
-            taxids = [int(taxid.replace('ncbi', '')) for taxid in self.matrix.columns]
-            taxid2name = self.ncbi.get_taxid_translator(taxids)
-            taxid2name = {f'ncbi{taxid}': name for taxid, name in taxid2name.items()}
-            return phylo_heatmap(self.matrix.rename(columns=taxid2name), clustermethod, **kwargs)
+            taxid2name = self.ncbi.get_taxid_translator(matrix.columns.tolist())
+            return phylo_heatmap(matrix.rename(columns=taxid2name), clustermethod, deduplicate=deduplicate, decimals=decimals, **kwargs)
         else:
-            return phylo_heatmap(self.matrix, clustermethod, **kwargs)
+            return phylo_heatmap(matrix, clustermethod, deduplicate=deduplicate, decimals=decimals, **kwargs)
+
+    def patterns(self, decimals=None):
+        """
+        Return the unique gene patterns (rows) of the numeric matrix as a DataFrame with a 'genes' column that counts the genes sharing each pattern,
+        and a Series mapping every gene to the number of its pattern
+        """
+        matrix = self._numeric_matrix()
+        patterns, inverse, counts = unique_rows(matrix.to_numpy(), decimals=decimals)
+        df = pd.DataFrame(patterns, columns=matrix.columns)
+        df['genes'] = counts
+        return df, pd.Series(inverse, index=matrix.index, name='pattern')
 
     def genes(self):
         return self.matrix.index
 
     def taxa(self, return_as='int'):
         if return_as == 'int':
-            return [int(taxon.replace('ncbi', '')) for taxon in self.matrix.columns]
+            return self.matrix.columns.tolist()
         # elif return_as == 'names':
             
         # return self.matrix.columns
 
 
-    def write_orthoxml():
-        pass
-        
+    def write_orthoxml(self, path='./output.orthoxml', database='fDOG', names=True, compression='infer', threads=1):
+        """
+        Write the stored orthologs to an OrthoXML file, streamed from the ortholog records. One orthologGroup is written per gene.
+        database: str -> Name of the database element of each species
+        names: bool -> Use NCBI species names instead of taxids as species names
+        compression: ['infer', 'gzip', 'bgzip', 'zstd', None] -> Per default inferred from the suffix of path
+        threads: int -> Threads for compression
+        """
+        taxid2name = {}
+        if names:
+            taxid2name = self.ncbi.get_taxid_translator(self.matrix.columns.tolist())
+        write_orthoxml(path, self._records(), self.matrix.columns, taxid2name, database=database, compression=compression, threads=threads)
+
+    def diff(self, other):
+        """
+        Compare the orthologs of this profile with those of another profile (e.g. of a newer pipeline version).
+        Returns a ProfileDiff with the gained, lost and shared orthologs, score changes and per-gene and per-taxon summaries.
+        """
+        return ProfileDiff(self._records(), other._records())
+
+    def intersect(self, other):
+        """Return a new PhyloProfile with the orthologs present in both profiles, with the scores of this profile"""
+        records = intersect_records(self._records(), other._records())
+        return PhyloProfile._from_records(records, self.style, ncbi=self.ncbi)
 
+    def union(self, other):
+        """Return a new PhyloProfile with the orthologs of both profiles. Shared orthologs keep the scores of this profile"""
+        return self.merge(other, how='self')
+
+    def merge(self, other, how='self'):
+        """
+        Return a new PhyloProfile with the orthologs of both profiles.
+        how: ['self', 'other', 'max', 'min', 'mean'] -> Scores of orthologs present in both profiles
+        """
+        how = {'self': 'a', 'other': 'b'}.get(how, how)
+        records = merge_records(self._records(), other._records(), how=how)
+        return PhyloProfile._from_records(records, self.style, ncbi=self.ncbi)
+
+    def to_arrow(self, table='matrix'):
+        """
+        Return the profile as a pyarrow Table, e.g. for polars.from_arrow() or DuckDB.
+        table: ['matrix', 'records'] -> The genes x taxa matrix (numeric columns are shared without copies) or the long ortholog records
+        """
+        if table == 'matrix':
+            return arrow.matrix_to_arrow(self.matrix, self.style)
+        elif table == 'records':
+            return arrow.records_to_arrow(self._records(), self.style)
+        else:
+            raise ValueError(f'Unknown table "{table}". Choose "matrix" or "records"')
+
+    def write_feather(self, path, table='matrix', compression='uncompressed', taxonomy=False):
+        """
+        Write the matrix or the ortholog records to an Arrow IPC (Feather v2) file.
+        compression: ['uncompressed', 'lz4', 'zstd'] -> Uncompressed files can be memory-mapped without copies by read_feather
+        taxonomy: bool -> Also save a taxonomy snapshot of the taxa next to the file, which read_feather uses
+        """
+        arrow.write_feather(self.to_arrow(table), path, compression=compression)
+        if taxonomy:
+            self.write_taxonomy(taxonomy_path(path))
+
+    @classmethod
+    def from_arrow(cls, matrix=None, records=None, style=None, fillna=0, taxonomy=None, debug=False, silent=False):
+        """
+        Create a PhyloProfile from pyarrow Tables as returned by to_arrow(). At least one of both is required.
+        matrix: pyarrow.Table -> Matrix table. Numeric columns are used without copies
+        records: pyarrow.Table -> Ortholog records. Required for writing and comparing orthologs and for style 'orthoid'. Without matrix, the matrix is built from the records
+        style: str -> Overrides the style stored in the table metadata
+        taxonomy: str -> Path of a taxonomy snapshot or 'ncbi' (default) for the NCBI Taxonomy database
+        """
+        if matrix is None and records is None:
+            raise ValueError('Provide a matrix table, a records table or both')
+        style = style or arrow.arrow_style(matrix if matrix is not None else records)
+        records = arrow.arrow_to_records(records) if records is not None else None
+
+        if matrix is None:
+            return cls._from_records(records, style, fillna=fillna, taxonomy=taxonomy, debug=debug, silent=silent)
+
+        df = arrow.arrow_to_matrix(matrix)
+        genes, taxa = list(df.index), list(df.columns)
+        if records is not None and style == 'orthoid':
+            return cls._from_records(records, style, genes, taxa, fillna=fillna, taxonomy=taxonomy, debug=debug, silent=silent)
+        elif records is not None:
+            # the matrix table is used as it is, only the outmatrix is built from the records
+            return cls._from_frames(df, records_to_outmatrix(records, genes, taxa, fillna), style, taxonomy=taxonomy, debug=debug, silent=silent)
+        elif style == 'orthoid' and df.dtypes.map(lambda dtype: dtype.kind == 'i').all():
+            raise ValueError('The orthoID cell codes of a compact "orthoid" matrix can only be resolved together with the records table')
+        elif style == 'orthoid':
+            df = arrow.list_cells(df, fillna)
+        return cls._from_frames(df, None, style, taxonomy=taxonomy, debug=debug, silent=silent)
+
+    @classmethod
+    def read_feather(cls, matrix_path='', records_path='', memory_map=True, style=None, taxonomy=None, debug=False, silent=False):
+        """
+        Create a PhyloProfile from Arrow IPC (Feather v2) files written by write_feather(). Uncompressed files are memory-mapped.
+        A taxonomy snapshot saved next to one of the files is used instead of the NCBI Taxonomy database unless taxonomy is given.
+        """
+        matrix = arrow.read_feather(matrix_path, memory_map=memory_map) if matrix_path else None
+        records = arrow.read_feather(records_path, memory_map=memory_map) if records_path else None
+        if taxonomy is None:
+            snapshots = [taxonomy_path(path) for path in [matrix_path, records_path] if path and os.path.isfile(taxonomy_path(path))]
+            taxonomy = snapshots[0] if snapshots else None
+        return cls.from_arrow(matrix, records, style=style, taxonomy=taxonomy, debug=debug, silent=silent)
+
+    @classmethod
+    def _from_records(cls, records, style, genes=None, taxa=None, fillna=0, ncbi=None, taxonomy=None, debug=False, silent=False):
+        """Create a PhyloProfile from a DataFrame of ortholog records (geneID, ncbiID, orthoID, FAS_F, FAS_B)"""
+        genes = list(pd.unique(records.geneID)) if genes is None else genes
+        taxa = pd.unique(records.ncbiID).tolist() if taxa is None else taxa
+        orthoids = None
+        if style == 'orthoid':
+            orthoids, codes = OrthoIDStore.from_records(records, cell_keys(records, genes, taxa), (len(genes), len(taxa)))
+            df = pd.DataFrame(codes, index=genes, columns=taxa)
+            outdf = CompactOutmatrix(orthoids, df, fillna)
+        else:
+            df = records_to_matrix(records, genes, taxa, style, fillna, resolve_coorthologs=True)
+            outdf = records_to_outmatrix(records, genes, taxa, fillna)
+        return cls._from_frames(df, outdf, style, orthoids=orthoids, ncbi=ncbi, taxonomy=taxonomy, debug=debug, silent=silent)
 
+    @classmethod
+    def _from_frames(cls, matrix, outmatrix, style, orthoids=None, ncbi=None, taxonomy=None, debug=False, silent=False):
+        """Create a PhyloProfile from already loaded frames, bypassing the phyloprofile parser. Opens the taxonomy unless ncbi is given."""
+        pp = cls.__new__(cls)
+        if ncbi is None:
+            phyloprofile_logger(debug=debug, silent=silent)
+            ncbi = open_taxonomy('ncbi' if taxonomy is None else taxonomy)
+        pp.ncbi = ncbi
+        pp.matrix, pp.outmatrix, pp.orthoids = matrix, outmatrix, orthoids
+        pp.style = style
+        pp._index = None
+        pp._summary = None
+        pp._presence = None
+        return pp
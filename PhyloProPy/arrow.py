@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+from PhyloProPy.indexing import taxon_to_int
+
+
+STYLE_KEY = b'phyloprofile.style'
+
+
+def matrix_to_arrow(matrix, style):
+    """
+    Convert a PhyloProfile matrix into a pyarrow Table with a geneID column and one column per taxon.
+    Numeric taxon columns that are stored contiguously (as after loading) are wrapped without copying.
+    """
+    import pyarrow as pa
+
+    columns = [pa.array(matrix.index.astype(str))]
+    for taxon in matrix.columns:
+        values = matrix[taxon].to_numpy()
+        if values.dtype == object:
+            # cells without orthologs hold the fill value next to lists of orthoIDs and are stored as nulls
+            is_list = np.array([isinstance(value, list) for value in values], dtype=bool)
+            if is_list.any():
+                values = np.where(is_list, values, None)
+            columns.append(pa.array(values, from_pandas=True))
+        else:
+            columns.append(pa.array(np.ascontiguousarray(values)))
+    names = ['geneID'] + [str(taxon) for taxon in matrix.columns]
+    return pa.Table.from_arrays(columns, names=names, metadata={STYLE_KEY: style.encode()})
+
+
+def records_to_arrow(records, style):
+    """Convert ortholog records (geneID, ncbiID, orthoID, FAS_F, FAS_B) into a pyarrow Table. Gene labels are dictionary-encoded, taxa are integer taxids."""
+    import pyarrow as pa
+
+    columns = {
+        'geneID': pa.array(records.geneID.to_numpy(dtype=object), type=pa.string()).dictionary_encode(),
+        'ncbiID': pa.array(records.ncbiID.to_numpy(dtype=np.int64)),
+        'orthoID': pa.array(records.orthoID.to_numpy(dtype=object), type=pa.string()),
+        'FAS_F': pa.array(records.FAS_F.to_numpy(dtype=float)),
+        'FAS_B': pa.array(records.FAS_B.to_numpy(dtype=float)),
+    }
+    return pa.table(columns, metadata={STYLE_KEY: style.encode()})
+
+
+def arrow_to_matrix(table):
+    """Convert a matrix Table back into a DataFrame indexed by geneID. Numeric columns without nulls are not copied."""
+    df = table.drop_columns(['geneID']).to_pandas(split_blocks=True)
+    df.index = pd.Index(table.column('geneID').to_pylist(), dtype=object)
+    df.columns = taxon_columns(df.columns)
+    return df
+
+
+def list_cells(df, fillna=0):
+    """Turn the cells of list columns (orthoIDs), which arrive as numpy arrays, back into lists. Null cells get the fill value."""
+    for column in df.columns[df.dtypes == object]:
+        df[column] = [value.tolist() if hasattr(value, 'tolist') else fillna if value is None else value for value in df[column]]
+    return df
+
+
+def taxon_columns(names):
+    """Turn column names that are all taxids ('1234' or 'ncbi1234') into integer taxid columns. Other names are kept."""
+    taxids = [taxon_to_int(name) for name in names]
+    if any(taxid is None for taxid in taxids):
+        return pd.Index(names)
+    return pd.Index(taxids, dtype=np.int64)
+
+
+def arrow_to_records(table):
+    """Convert a records Table back into a DataFrame of ortholog records with categorical gene labels and integer taxids."""
+    df = table.to_pandas(split_blocks=True)
+    df['geneID'] = df.geneID.astype('category')
+    if not pd.api.types.is_integer_dtype(df.ncbiID):
+        # tables written with string taxon labels
+        codes, uniques = pd.factorize(df.ncbiID)
+        df['ncbiID'] = np.array([taxon_to_int(taxon) for taxon in uniques], dtype=np.int64)[codes]
+    return df
+
+
+def arrow_style(table, default='fasf'):
+    """Read the style stored in the schema metadata of a Table"""
+    metadata = table.schema.metadata or {}
+    return metadata.get(STYLE_KEY, default.encode()).decode()
+
+
+def write_feather(table, path, compression='uncompressed'):
+    """
+    Write a Table to an Arrow IPC (Feather v2) file.
+    compression: ['uncompressed', 'lz4', 'zstd'] -> Only uncompressed files can be memory-mapped without copies when reading
+    """
+    from pyarrow import feather
+    feather.write_feather(table, path, compression=compression)
+
+
+def read_feather(path, memory_map=True):
+    """Read an Arrow IPC (Feather v2) file as a Table. With memory_map, the columns of uncompressed files point into the mapped file."""
+    from pyarrow import feather
+    return feather.read_table(path, memory_map=memory_map)
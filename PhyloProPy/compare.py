@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+
+def encode_records(a, b):
+    """
+    Integer-code the orthologs of two record tables in a shared key space. An ortholog is identified by its gene,
+    taxon and orthoID. Returns the ortholog keys of a and b, the number of distinct keys, the cell (gene x taxon) of
+    each record and the shared gene and taxon labels.
+    """
+    gene_codes, genes = pd.factorize(np.concatenate([a.geneID.to_numpy(dtype=object), b.geneID.to_numpy(dtype=object)]))
+    taxon_codes, taxa = pd.factorize(np.concatenate([a.ncbiID.to_numpy(dtype=object), b.ncbiID.to_numpy(dtype=object)]))
+    ortho_codes, orthoids = pd.factorize(np.concatenate([a.orthoID.to_numpy(dtype=object), b.orthoID.to_numpy(dtype=object)]))
+    cells = gene_codes.astype(np.int64) * len(taxa) + taxon_codes
+    if len(genes) * len(taxa) * max(len(orthoids), 1) < 2 ** 62:
+        keys, uniques = pd.factorize(cells * len(orthoids) + ortho_codes)
+    else:
+        keys, uniques = pd.MultiIndex.from_arrays([cells, ortho_codes]).factorize()
+    n = len(a)
+    return keys[:n], keys[n:], len(uniques), cells[:n], cells[n:], pd.Index(genes), pd.Index(taxa)
+
+
+def pack_presence(keys, n):
+    """Return a bit-packed presence vector of length n with the bits of keys set"""
+    mask = np.zeros(n, dtype=bool)
+    mask[keys] = True
+    return np.packbits(mask)
+
+
+def contains(packed, keys):
+    """Test the bits of keys in a bit-packed presence vector"""
+    return ((packed[keys >> 3] >> (7 - (keys & 7))) & 1).astype(bool)
+
+
+class ProfileDiff():
+    """
+    Differences between the ortholog records of two profiles, from a (e.g. an older pipeline version) to b.
+    gained: DataFrame -> Orthologs only in b
+    lost: DataFrame -> Orthologs only in a
+    shared: DataFrame -> Orthologs in both, with the scores of a and b and their difference (b - a)
+    genes: DataFrame -> Per-gene numbers of gained/lost orthologs and taxa, and the mean score changes
+    taxa: DataFrame -> The same per taxon
+    """
+    def __init__(self, a, b):
+        keys_a, keys_b, n, cells_a, cells_b, genes, taxa = encode_records(a, b)
+        in_a, in_b = pack_presence(keys_a, n), pack_presence(keys_b, n)
+        lost_mask, gained_mask = ~contains(in_b, keys_a), ~contains(in_a, keys_b)
+        self.gained = b[gained_mask].reset_index(drop=True)
+        self.lost = a[lost_mask].reset_index(drop=True)
+
+        # scores of orthologs in both profiles, matched by key
+        position_b = np.full(n, -1, dtype=np.int64)
+        position_b[keys_b] = np.arange(len(keys_b))
+        shared_a = np.flatnonzero(~lost_mask)
+        shared_b = position_b[keys_a[shared_a]]
+        shared = a.iloc[shared_a][['geneID', 'ncbiID', 'orthoID']].reset_index(drop=True)
+        for column in ['FAS_F', 'FAS_B']:
+            score_a, score_b = a[column].to_numpy(dtype=float)[shared_a], b[column].to_numpy(dtype=float)[shared_b]
+            shared[f'{column}_a'], shared[f'{column}_b'], shared[f'delta_{column}'] = score_a, score_b, score_b - score_a
+        self.shared = shared
+
+        # cells (gene x taxon) with orthologs in only one profile
+        unique_a, unique_b = np.unique(cells_a), np.unique(cells_b)
+        gained_cells = unique_b[~np.isin(unique_b, unique_a, assume_unique=True)]
+        lost_cells = unique_a[~np.isin(unique_a, unique_b, assume_unique=True)]
+
+        ntaxa = len(taxa)
+        shared_cells = cells_a[shared_a]
+        self.genes = self._summarize(
+            genes, len(genes), cells_b[gained_mask] // ntaxa, cells_a[lost_mask] // ntaxa,
+            gained_cells // ntaxa, lost_cells // ntaxa, shared_cells // ntaxa, shared, 'taxa'
+        )
+        self.taxa = self._summarize(
+            taxa, ntaxa, cells_b[gained_mask] % ntaxa, cells_a[lost_mask] % ntaxa,
+            gained_cells % ntaxa, lost_cells % ntaxa, shared_cells % ntaxa, shared, 'genes'
+        )
+
+    @staticmethod
+    def _summarize(labels, n, gained, lost, gained_cells, lost_cells, shared, shared_records, other):
+        """Count gained/lost orthologs and cells and average score changes per gene or per taxon code"""
+        summary = pd.DataFrame({
+            'gained_orthologs': np.bincount(gained, minlength=n),
+            'lost_orthologs': np.bincount(lost, minlength=n),
+            f'gained_{other}': np.bincount(gained_cells, minlength=n),
+            f'lost_{other}': np.bincount(lost_cells, minlength=n),
+            'shared_orthologs': np.bincount(shared, minlength=n),
+        }, index=labels)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for column in ['delta_FAS_F', 'delta_FAS_B']:
+                deltas = shared_records[column].to_numpy(dtype=float)
+                valid = ~np.isnan(deltas)
+                total = np.bincount(shared[valid], weights=deltas[valid], minlength=n)
+                summary[f'mean_{column}'] = total / np.bincount(shared[valid], minlength=n)
+        return summary
+
+    def __repr__(self):
+        changed = int((self.shared[['delta_FAS_F', 'delta_FAS_B']].abs() > 0).any(axis=1).sum())
+        return f'ProfileDiff(gained={len(self.gained)}, lost={len(self.lost)}, shared={len(self.shared)}, score_changes={changed})'
+
+
+def intersect_records(a, b):
+    """Orthologs present in both record tables, with the records of a"""
+    keys_a, keys_b, n, *_ = encode_records(a, b)
+    return a[contains(pack_presence(keys_b, n), keys_a)].reset_index(drop=True)
+
+
+def merge_records(a, b, how='a'):
+    """
+    All orthologs of both record tables. For orthologs in both, how decides which scores are kept.
+    how: ['a', 'b', 'max', 'min', 'mean']
+    """
+    keys_a, keys_b, n, *_ = encode_records(a, b)
+    merged = pd.concat([a, b[~contains(pack_presence(keys_a, n), keys_b)]], ignore_index=True)
+    if how == 'a':
+        return merged
+    if how not in ['b', 'max', 'min', 'mean']:
+        raise ValueError(f'Unknown merge "{how}". Choose "a", "b", "max", "min" or "mean"')
+
+    position_b = np.full(n, -1, dtype=np.int64)
+    position_b[keys_b] = np.arange(len(keys_b))
+    matched = position_b[keys_a]
+    shared = np.flatnonzero(matched >= 0)
+    for column in ['FAS_F', 'FAS_B']:
+        score_a = merged[column].to_numpy(dtype=float, copy=True)
+        score_b = b[column].to_numpy(dtype=float)[matched[shared]]
+        if how == 'b':
+            score_a[shared] = score_b
+        elif how == 'max':
+            score_a[shared] = np.fmax(score_a[shared], score_b)
+        elif how == 'min':
+            score_a[shared] = np.fmin(score_a[shared], score_b)
+        else:
+            score_a[shared] = (score_a[shared] + score_b) / 2
+        merged[column] = score_a
+    return merged
@@ -0,0 +1,102 @@
+import gzip
+import io
+import os
+
+
+MAGIC = {
+    b'\x1f\x8b': 'gzip',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+}
+
+SUFFIXES = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.bgz': 'bgzip',
+    '.bgzip': 'bgzip',
+    '.zst': 'zstd',
+    '.zstd': 'zstd',
+}
+
+
+def infer_compression(path, mode='r'):
+    """
+    Infer the compression of a file. Files that are read are identified by their magic bytes, files that are
+    written by their suffix. BGZF files are gzip files and are read as such.
+    """
+    if 'r' in mode and hasattr(path, 'read'):
+        position = path.tell()
+        start = path.read(4)
+        path.seek(position)
+    elif 'r' in mode:
+        with open(path, 'rb') as fh:
+            start = fh.read(4)
+    if 'r' in mode:
+        for magic, compression in MAGIC.items():
+            if start.startswith(magic):
+                return compression
+        return None
+    return SUFFIXES.get(os.path.splitext(str(path))[1].lower())
+
+
+def open_text(path, mode='r', compression='infer', threads=1, level=None):
+    """
+    Open a plain, gzip, bgzip or zstd compressed file in text mode.
+    path: str/file -> Path, or a seekable binary file object for reading (e.g. to follow how many bytes were read with its tell())
+    compression: ['infer', 'gzip', 'bgzip', 'zstd', None] -> 'infer' uses the magic bytes (reading) or the suffix (writing)
+    threads: int -> Threads for (de)compression. Used for gzip by python-isal and for zstd compression by zstandard.
+    level: int -> Compression level, defaults to the default of each format
+    """
+    if mode not in ('r', 'w', 'a'):
+        raise ValueError(f'Unknown mode "{mode}". Choose "r", "w" or "a"')
+    if compression == 'infer':
+        compression = infer_compression(path, mode)
+
+    if compression is None and hasattr(path, 'read'):
+        return io.TextIOWrapper(path, encoding='utf-8')
+    elif compression is None:
+        return open(path, mode, encoding='utf-8')
+    elif compression == 'gzip' or (compression == 'bgzip' and mode == 'r'):
+        if threads > 1:
+            try:
+                from isal import igzip_threaded
+                kwargs = {} if level is None else {'compresslevel': level}
+                return igzip_threaded.open(path, f'{mode}t', encoding='utf-8', threads=threads, **kwargs)
+            except ImportError:
+                pass
+        return gzip.open(path, f'{mode}t', encoding='utf-8', compresslevel=6 if level is None else level)
+    elif compression == 'bgzip':
+        try:
+            from Bio import bgzf
+        except ImportError:
+            raise ImportError('Writing bgzip files requires biopython. Install it with "pip install biopython"')
+        handle = _BgzfRaw(bgzf.BgzfWriter(path, f'{mode}b', compresslevel=6 if level is None else level))
+        return io.TextIOWrapper(io.BufferedWriter(handle), encoding='utf-8')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Reading and writing zstd files requires zstandard. Install it with "pip install zstandard"')
+        if mode == 'r':
+            return zstandard.open(path, 'rt', encoding='utf-8')
+        cctx = zstandard.ZstdCompressor(level=3 if level is None else level, threads=threads if threads > 1 else 0)
+        return zstandard.open(path, f'{mode}t', cctx=cctx, encoding='utf-8')
+    else:
+        raise ValueError(f'Unknown compression "{compression}". Choose "gzip", "bgzip", "zstd" or None')
+
+
+class _BgzfRaw(io.RawIOBase):
+    """Minimal raw stream around a Bio.bgzf.BgzfWriter, so that it can be wrapped by io.TextIOWrapper."""
+    def __init__(self, writer):
+        self.writer = writer
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.writer.write(bytes(b))
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self.writer.close()
+        super().close()
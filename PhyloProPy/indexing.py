@@ -0,0 +1,64 @@
+import numpy as np
+
+
+def taxon_to_int(taxon):
+    """Convert a taxon label (1234, '1234' or 'ncbi1234') to an integer taxid. Returns None for unparsable labels."""
+    if isinstance(taxon, (int, np.integer)):
+        return int(taxon)
+    taxon = str(taxon)
+    if taxon.startswith('ncbi'):
+        taxon = taxon[4:]
+    try:
+        return int(taxon)
+    except ValueError:
+        return None
+
+
+def selection(labels):
+    """Return labels (list, Index, array or Series), or None if no labels are given"""
+    return None if labels is None or len(labels) == 0 else labels
+
+
+class ProfileIndex():
+    """
+    Integer codes and label->position hash maps for the rows (genes) and columns (taxa) of a PhyloProfile matrix.
+    Built once per set of labels, so that looking up many small gene/taxon sets does not touch the full frame.
+    """
+    def __init__(self, genes, taxa):
+        self.labels = (genes, taxa)
+        self.genes = np.asarray(genes, dtype=object)
+        self.taxa = np.array([taxon_to_int(taxon) for taxon in taxa], dtype=np.int64)
+        self.gene2pos = {gene: pos for pos, gene in enumerate(self.genes)}
+        self.taxon2pos = {taxid: pos for pos, taxid in enumerate(self.taxa)}
+
+    def matches(self, df):
+        """Check whether the index was built from the labels of df"""
+        genes, taxa = self.labels
+        return genes is df.index and taxa is df.columns
+
+    def gene_codes(self, genes):
+        """Return the integer codes (row positions) of genes. Unknown genes are skipped."""
+        gene2pos = self.gene2pos
+        return np.fromiter((gene2pos[gene] for gene in genes if gene in gene2pos), dtype=np.intp)
+
+    def taxon_codes(self, taxa):
+        """Return the integer codes (column positions) of taxa given as int, 'taxid' or 'ncbitaxid'. Unknown taxa are skipped."""
+        taxon2pos = self.taxon2pos
+        taxids = (taxon_to_int(taxon) for taxon in taxa)
+        return np.fromiter((taxon2pos[taxid] for taxid in taxids if taxid in taxon2pos), dtype=np.intp)
+
+    def select(self, df, genes=None, taxa=None):
+        """
+        Select genes and taxa from df (which must match the index) in a single positional lookup.
+        Contiguous selections are returned as slices of df, other selections only copy the selected cells.
+        """
+        rows = slice(None) if genes is None else _as_slice(self.gene_codes(genes))
+        cols = slice(None) if taxa is None else _as_slice(self.taxon_codes(taxa))
+        return df.iloc[rows, cols]
+
+
+def _as_slice(positions):
+    """Turn an ascending run of consecutive positions into a slice object so that pandas can return a view."""
+    if len(positions) and positions[-1] - positions[0] == len(positions) - 1 and np.all(np.diff(positions) == 1):
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
@@ -1,6 +1,16 @@
-import pandas as pd
+import csv
+import itertools
 import logging
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
 from PhyloProPy.mapping import check_taxonomy_input
+from PhyloProPy.compression import open_text
+from PhyloProPy.orthoids import OrthoIDStore, CompactOutmatrix
+from PhyloProPy.progress import LoadProgress
+
+
+PHYLOPROFILE_COLUMNS = ['geneID', 'ncbiID', 'orthoID', 'FAS_F', 'FAS_B']
 
 def order_taxa(tree, reference):
     """Order taxa according to a tree object from the ete3 package."""
@@ -36,9 +46,9 @@ def order_taxa(tree, reference):
     ##################################################################################################
     initial = initial_list(tree, reference)
     specorder = order_species(initial)
-    ordernames = [f'ncbi{taxid}' for taxid in specorder]
+    ordertaxids = [int(taxid) for taxid in specorder]
 
-    return ordernames
+    return ordertaxids
 
 
 def sort_phyloprofile(df, ncbi, reference):
@@ -47,7 +57,7 @@ def sort_phyloprofile(df, ncbi, reference):
     logger.info(f'Reordering matrix according to "{reference}"')
 
     # find all taxids
-    taxids = [int(taxid.replace('ncbi', '')) for taxid in df.columns]
+    taxids = [int(taxid) for taxid in df.columns]
     tree = ncbi.get_topology(taxids)
     
     # check format of reference
@@ -59,7 +69,7 @@ def sort_phyloprofile(df, ncbi, reference):
     # check that reference is valid
     if not reference in taxids:
         logger.warning(f'Could not find {reference} in the taxonomy IDs of your PhyloProfile file. Skipping ordering..')
-        return df
+        return df, list(df.columns)
     
     # retrieve order
     order = order_taxa(tree, str(reference))
@@ -68,96 +78,241 @@ def sort_phyloprofile(df, ncbi, reference):
     return df[order], order
 
 
-def phyloprofile2matrix(path, ncbi, style, from_custom, fasF_filter, fasB_filter, fillna, resolve_coorthologs, reference):
+def iter_phyloprofile_records(path, from_custom=False, threads=1, chunksize=1000000, progress=None):
     """
-    Convert a phyloprofile file into a 2D matrix.
-    Creates a copy of matrix containing the forward and backward FAS scores for writing phyloprofile output files.
+    Read the ortholog records of a plain or compressed phyloprofile file in blocks of chunksize lines.
+    Yields DataFrames with the columns geneID (categorical), ncbiID (integer taxids), orthoID, FAS_F and FAS_B.
+    Missing FAS scores are set to 1, scores that are "NA" become NaN.
+    progress: LoadProgress -> Reports every block and stops with LoadCancelled between blocks if the load is cancelled
     """
-
-    def initialize_phyloprofile_df(path, gene_idx, taxa_idx):
-        taxa = set()
-        genes = set()
-        with open(path) as fh:
-            header = next(fh)
-            for line in fh:
-                dl = line.strip().split('\t')[:5]
-                taxa.add(dl[taxa_idx])
-                genes.add(dl[gene_idx])
-        if not all(s.startswith('ncbi') for s in taxa):
-            raise ValueError(f'Taxids in PhyloProfile file do not start with "ncbi". Alternatively, you might need to set "from_custom" to True.')
-        return pd.DataFrame(index=list(genes), columns=list(taxa))
-
-    def fill_phyloprofile_dataframe(df, path, style, gene_idx, taxa_idx, ortho_idx, fasf_idx, fasb_idx):
-        """Fill the empty dataframe with a list of values to accomodate co-orthologs. Then resolve the lists."""
-        def update_cell(df, gene, taxid, value):
-            cell_value = df.at[gene, taxid]
-            if isinstance(cell_value, float):
-                df.loc[gene, taxid] = [value]
-            elif isinstance(cell_value, list):
-                df.loc[gene, taxid].append(value)
-            else:
-                raise ValueError('Wrong initialzation of DataFrame for loading PhyloProfile.')
-
-        ##################################################################
-        outdf = df.copy()
-        with open(path) as fh:
-            header = next(fh)
-            for line in fh:
-                dl = line.strip().split('\t')
-                if len(dl) <= fasf_idx:
-                    fasf, fasb = 1, 1
-                    gene, orthoid, taxid = dl[gene_idx], dl[ortho_idx], dl[taxa_idx]
-                elif len(dl) <= fasb_idx:
-                    fasb = 1
-                    gene, orthoid, taxid, fasf = dl[gene_idx], dl[ortho_idx], dl[taxa_idx], float(dl[fasf_idx])
-                else:
-                    fasf, fasb = dl[fasf_idx], dl[fasb_idx]
-                    if fasf == 'NA':
-                        continue
-                    gene, orthoid, taxid, fasf, fasb = dl[gene_idx], dl[ortho_idx], dl[taxa_idx], float(dl[fasf_idx]), float(dl[fasb_idx])
-                
-                # apply filter
-                if fasf < fasF_filter or fasb < fasB_filter:
-                    continue
-
-                # Fill with list
-                if style == 'orthoid':
-                    update_cell(df, gene, taxid, orthoid)
-                elif style == 'ncRNA':
-                    seedscore = fasf
-                    if seedscore == 0.0:
-                        seedscore = 0.5
-                    update_cell(df, gene, taxid, seedscore)
-                elif style in ['fasf', 'fasb']:
-                    value = fasf if style == 'fasf' else fasb
-                    update_cell(df, gene, taxid, value)
-                elif style == 'binary':
-                    df.loc[gene, taxid] = 1
-                else:
-                    raise ValueError(f'Cannot fill matrix in style "{style}". Choose "orthoid", "fasf", "fasb" or "binary"')
-                
-                # Update outdf 
-                update_cell(outdf, gene, taxid, (orthoid, fasf, fasb))
-
-        # resolve lists for scores
-        df, outdf = df.fillna(fillna), outdf.fillna(fillna)
-        if resolve_coorthologs and style in ['fasf', 'fasb', 'ncRNA']:
-            df = df.applymap(lambda x: max(x) if isinstance(x, list) else x)
-        
-        return df, outdf
-
-    ##################################################################################################
-    logger = logging.getLogger('phyloprofile')
-    
     if from_custom:
         gene_idx, taxa_idx, ortho_idx, fasf_idx, fasb_idx = 0, 3, 1, 5, 6
     else:
         gene_idx, taxa_idx, ortho_idx, fasf_idx, fasb_idx = 0, 1, 2, 3, 4
+    usecols = [gene_idx, taxa_idx, ortho_idx, fasf_idx, fasb_idx]
+
+    with open(path, 'rb') as raw, open_text(raw, threads=threads) as fh:
+        if progress is not None:
+            progress.attach(raw)
+            progress.check()
+        # files may lack the FAS columns in all lines (pandas rejects usecols beyond the columns it finds), so all
+        # columns of the header are read and missing trailing fields become empty strings
+        columns = len(fh.readline().rstrip('\r\n').split('\t'))
+        reader = pd.read_csv(
+            fh, sep='\t', header=None, names=range(max(columns, max(usecols) + 1)), index_col=False,
+            dtype=str, na_filter=False, quoting=csv.QUOTE_NONE, chunksize=chunksize,
+        )
+        for chunk in reader:
+            records = pd.DataFrame({column: chunk[idx] for column, idx in zip(PHYLOPROFILE_COLUMNS, usecols)})
+            records['geneID'] = records.geneID.astype('category')
+            records['ncbiID'] = parse_taxa(records.ncbiID)
+            for column in ['FAS_F', 'FAS_B']:
+                records[column] = records[column].replace({'': '1', 'NA': 'nan'}).astype(float)
+            if progress is not None:
+                progress.update(len(records))
+            yield records
+
+
+def read_phyloprofile_records(path, from_custom=False, threads=1, chunksize=1000000, progress=None):
+    """Read all ortholog records of a plain or compressed phyloprofile file into one DataFrame (see iter_phyloprofile_records)."""
+    chunks = list(iter_phyloprofile_records(path, from_custom, threads=threads, chunksize=chunksize, progress=progress))
+    return concat_records(chunks)
+
+
+def concat_records(chunks):
+    """Concatenate blocks of ortholog records, keeping the gene labels categorical across blocks with different genes."""
+    if not chunks:
+        return pd.DataFrame({
+            'geneID': pd.Categorical([]), 'ncbiID': pd.Series(dtype=np.int64), 'orthoID': pd.Series(dtype=object),
+            'FAS_F': pd.Series(dtype=float), 'FAS_B': pd.Series(dtype=float),
+        })
+    records = pd.concat(chunks, ignore_index=True)
+    if all(isinstance(chunk.geneID.dtype, pd.CategoricalDtype) for chunk in chunks):
+        records['geneID'] = union_categoricals([chunk.geneID for chunk in chunks])
+    return records
+
+
+def parse_taxa(labels):
+    """Convert the ncbi<taxid> labels of a phyloprofile file to integer taxids. Each distinct label is parsed once."""
+    codes, uniques = pd.factorize(labels)
+    if not all(label.startswith('ncbi') for label in uniques):
+        raise ValueError(f'Taxids in PhyloProfile file do not start with "ncbi". Alternatively, you might need to set "from_custom" to True.')
+    try:
+        taxids = np.array([int(label[4:]) for label in uniques], dtype=np.int64)
+    except ValueError:
+        raise ValueError(f'Taxids in PhyloProfile file are not of the form "ncbi<taxid>"')
+    return pd.Series(taxids[codes], index=labels.index)
+
+
+def format_taxa(taxa):
+    """Format integer taxids as the ncbi<taxid> labels of phyloprofile files"""
+    codes, uniques = pd.factorize(pd.Series(taxa))
+    return np.array([f'ncbi{taxid}' for taxid in uniques], dtype=object)[codes]
+
+
+def cell_keys(records, genes, taxa):
+    """
+    Return the flat position (column * number of genes + row) of each record in a genes x taxa matrix. Unknown labels get -1.
+    Positions are column-major, so that matrices built from them store each taxon column contiguously.
+    """
+    rows = label_positions(genes, records.geneID)
+    cols = pd.Index(taxa).get_indexer(records.ncbiID)
+    keys = cols.astype(np.int64) * len(genes) + rows
+    keys[(rows < 0) | (cols < 0)] = -1
+    return keys
+
+
+def label_positions(labels, values):
+    """Positions of values in labels (-1 if missing). Categorical values are looked up once per category."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        positions = pd.Index(labels).get_indexer(values.cat.categories)
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, positions[codes], -1)
+    return pd.Index(labels).get_indexer(values)
+
+
+def collect_cells(keys, columns, shape, fillna):
+    """
+    Gather the values of one or more columns into one list per matrix cell (tuples if several columns are given).
+    Cells without values are set to fillna. Returns a 2D object array of shape (genes x taxa) for column-major keys.
+    """
+    keep = keys >= 0
+    order = np.argsort(keys[keep], kind='stable')
+    keys = keys[keep][order]
+    columns = [np.asarray(column)[keep][order].tolist() for column in columns]
+    entries = columns[0] if len(columns) == 1 else list(zip(*columns))
+
+    cells = np.empty(shape[0] * shape[1], dtype=object)
+    cells[:] = fillna
+    bounds = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1], True]) if len(keys) else []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        cells[keys[start]] = entries[start:end]
+    return cells.reshape(shape[::-1]).T
+
+
+def records_to_matrix(records, genes, taxa, style, fillna, resolve_coorthologs):
+    """Pivot ortholog records into a genes x taxa matrix. Co-orthologs are collected in lists unless they are resolved to their maximum score."""
+    if style == 'orthoid':
+        values = records.orthoID
+    elif style == 'ncRNA':
+        values = records.FAS_F.mask(records.FAS_F == 0.0, 0.5)
+    elif style in ['fasf', 'fasb']:
+        values = records.FAS_F if style == 'fasf' else records.FAS_B
+    elif style == 'binary':
+        values = pd.Series(1, index=records.index)
+    else:
+        raise ValueError(f'Cannot fill matrix in style "{style}". Choose "orthoid", "fasf", "fasb" or "binary"')
+
+    keys = cell_keys(records, genes, taxa)
+    if style == 'binary' or (resolve_coorthologs and style in ['fasf', 'fasb', 'ncRNA']):
+        cells = np.full(len(genes) * len(taxa), np.nan)
+        np.fmax.at(cells, keys[keys >= 0], values.to_numpy(dtype=float)[keys >= 0])
+        dtype = matrix_dtype(style, fillna)
+        if dtype is None:
+            return pd.DataFrame(cells.reshape(len(taxa), len(genes)).T, index=genes, columns=taxa).fillna(fillna)
+        cells[np.isnan(cells)] = fillna
+        return pd.DataFrame(cells.astype(dtype).reshape(len(taxa), len(genes)).T, index=genes, columns=taxa)
+    return pd.DataFrame(collect_cells(keys, [values], (len(genes), len(taxa)), fillna), index=genes, columns=taxa)
+
+
+def matrix_dtype(style, fillna):
+    """
+    Compact dtype of a numeric matrix: uint8 for presence/absence filled with 0 or 1 and float32 for scores (and for
+    presence/absence with a fill value that is not 0 or 1, e.g. NaN). None if fillna is not a number.
+    """
+    if isinstance(fillna, (bool, np.bool_)) or not isinstance(fillna, (int, float, np.integer, np.floating)):
+        return None
+    if style == 'binary' and fillna in (0, 1):
+        return np.uint8
+    return np.float32
+
+
+def records_to_outmatrix(records, genes, taxa, fillna):
+    """Collect the (orthoID, FAS_F, FAS_B) tuples of all orthologs of a gene in a taxon in the cells of a genes x taxa matrix."""
+    keys = cell_keys(records, genes, taxa)
+    cells = collect_cells(keys, [records.orthoID, records.FAS_F, records.FAS_B], (len(genes), len(taxa)), fillna)
+    return pd.DataFrame(cells, index=genes, columns=taxa)
+
+
+def count_orthologs(outmatrix):
+    """Return an integer array with the number of orthologs stored in each cell of the outmatrix."""
+    values = outmatrix.to_numpy(dtype=object)
+    counts = np.frompyfunc(lambda x: len(x) if isinstance(x, list) else 0, 1, 1)(values)
+    return counts.astype(np.int64).reshape(values.shape)
+
+
+def outmatrix_to_records(outmatrix, blocksize=1000):
+    """
+    Flatten the outmatrix into a DataFrame of ortholog records (gene by gene, taxon by taxon).
+    Blocks of blocksize genes are flattened at a time, so that no dense genes x taxa arrays are allocated.
+    """
+    entries, rows, cols = [], [], []
+    for start in range(0, len(outmatrix), blocksize):
+        block = outmatrix.iloc[start:start + blocksize]
+        counts = count_orthologs(block)
+        block_rows, block_cols = np.nonzero(counts)
+        n = counts[block_rows, block_cols]
+        entries.extend(itertools.chain.from_iterable(block.to_numpy(dtype=object)[block_rows, block_cols]))
+        rows.append(np.repeat(block_rows + start, n))
+        cols.append(np.repeat(block_cols, n))
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    records = pd.DataFrame.from_records(entries, columns=PHYLOPROFILE_COLUMNS[2:])
+    records.insert(0, 'geneID', pd.Categorical.from_codes(rows, categories=outmatrix.index))
+    records.insert(1, 'ncbiID', outmatrix.columns.to_numpy(dtype=np.int64)[cols])
+    return records
+
+
+def write_records(handle, records, header=True, chunksize=100000):
+    """
+    Write ortholog records to an open text handle in phyloprofile format (taxa as ncbi<taxid>), in blocks of chunksize lines.
+    Missing scores are written as NA, which is read back as NaN (an empty field would be read as a score of 1).
+    """
+    records = records[PHYLOPROFILE_COLUMNS].assign(ncbiID=format_taxa(records.ncbiID))
+    records.to_csv(
+        handle, sep='\t', index=False, header=header, lineterminator='\n', quoting=csv.QUOTE_NONE, chunksize=chunksize, na_rep='NA',
+    )
+
+
+def write_phyloprofile(records, path, compression='infer', threads=1, chunksize=100000):
+    """Write ortholog records to a plain or compressed phyloprofile file in blocks of chunksize lines."""
+    with open_text(path, 'w', compression=compression, threads=threads) as of:
+        write_records(of, records, chunksize=chunksize)
+
+
+def phyloprofile2matrix(
+    path, ncbi, style, from_custom, fasF_filter, fasB_filter, fillna, resolve_coorthologs, reference, threads=1, compact=False, progress=None, cancel=None, chunksize=1000000,
+):
+    """
+    Convert a phyloprofile file into a 2D matrix.
+    Creates a copy of matrix containing the forward and backward FAS scores for writing phyloprofile output files.
+    With style 'orthoid' and compact, the matrix holds integer cell codes into the returned OrthoIDStore (None otherwise)
+    and the outmatrix is a CompactOutmatrix that decodes the scores from the store instead of a copy.
+    progress: callable -> Called with a dict of the progress after every block of chunksize records and after every stage (see LoadProgress)
+    cancel: CancelToken -> Stops the load with LoadCancelled at the next block or stage
+    """
+    logger = logging.getLogger('phyloprofile')
 
     logger.info(f'Initializing PhyloProfile matrix')
-    df = initialize_phyloprofile_df(path, gene_idx, taxa_idx)
-    if reference: 
-        df, _ = sort_phyloprofile(df, ncbi, reference)
+    tracker = LoadProgress(path, progress, cancel)
+    records = read_phyloprofile_records(path, from_custom, threads=threads, chunksize=chunksize, progress=tracker)
+    genes, taxa = list(pd.unique(records.geneID)), pd.unique(records.ncbiID).tolist()
+    if reference:
+        _, taxa = sort_phyloprofile(pd.DataFrame(columns=taxa), ncbi, reference)
+
     logger.info(f'Loading PhyloProfile matrix')
-    df, outdf = fill_phyloprofile_dataframe(df, path, style, gene_idx, taxa_idx, ortho_idx, fasf_idx, fasb_idx)
-    return df, outdf
+    tracker.update(stage='matrix')
+    # records with a score of NA do not pass the filter
+    records = records[(records.FAS_F >= fasF_filter) & (records.FAS_B >= fasB_filter)]
+    orthoids = None
+    if style == 'orthoid' and compact:
+        orthoids, codes = OrthoIDStore.from_records(records, cell_keys(records, genes, taxa), (len(genes), len(taxa)))
+        df = pd.DataFrame(codes, index=genes, columns=taxa)
+        tracker.update(stage='outmatrix')
+        outdf = CompactOutmatrix(orthoids, df, fillna)
+    else:
+        df = records_to_matrix(records, genes, taxa, style, fillna, resolve_coorthologs)
+        tracker.update(stage='outmatrix')
+        outdf = records_to_outmatrix(records, genes, taxa, fillna)
+    tracker.update(stage='done')
+    return df, outdf, orthoids
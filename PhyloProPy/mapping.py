@@ -12,4 +12,15 @@ def check_taxonomy_input(lineage, ncbi):
         # try to parse species name to taxid
         name2taxid = ncbi.get_name_translator([lineage, lineage.replace('_', ' ')])
         if len(name2taxid) == 1:
-            return list(name2taxid.values())[0][0]
\ No newline at end of file
+            return list(name2taxid.values())[0][0]
+
+def taxa_to_rank(taxids, rank, ncbi):
+    """Map taxids to the taxid of their ancestor at rank. Taxa without an ancestor at rank are left out."""
+    taxid2group = {}
+    for taxid in taxids:
+        lineage = ncbi.get_lineage(taxid)
+        node2rank = ncbi.get_rank(lineage)
+        for node in lineage:
+            if node2rank.get(node) == rank:
+                taxid2group[taxid] = node
+    return taxid2group
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+
+
+class OrthoIDStore():
+    """
+    Dictionary-encoded storage for the orthoIDs of a phyloprofile (gene|SPEC@taxid@assembly|protein|flag).
+    The gene part is stored once per matrix cell, the species part once per distinct species, and only the
+    remaining protein part is kept per ortholog, concatenated into one bytes buffer addressed by offsets (so that a
+    few long orthoIDs do not widen the storage of all others). Co-orthologs of a cell are addressed by offsets
+    (indptr), so that a matrix of integer cell codes replaces a matrix of lists of strings.
+    The FAS scores of each ortholog are kept next to it, so that the ortholog records can be rebuilt without an outmatrix.
+    Cell code 0 means "no ortholog", code c refers to the (c - 1)th stored cell.
+    """
+    def __init__(self, genes, cell_genes, indptr, species, species_codes, rest, rest_offsets, raw, scores):
+        self.genes = genes                  # bytes array of gene labels
+        self.cell_genes = cell_genes        # int32, gene code of each cell
+        self.indptr = indptr                # int64, orthologs of cell i are indptr[i]:indptr[i + 1]
+        self.species = species              # bytes array of distinct species parts
+        self.species_codes = species_codes  # int32, species code of each ortholog
+        self.rest = rest                    # bytes, remainders of all orthoIDs one after another
+        self.rest_offsets = rest_offsets    # int64, remainder of ortholog i is rest[rest_offsets[i]:rest_offsets[i + 1]]
+        self.raw = raw                      # bool, orthoIDs that did not follow the pattern are stored whole in rest
+        self.scores = scores                # float64, FAS_F and FAS_B of each ortholog (n x 2)
+
+    @classmethod
+    def from_records(cls, records, keys, shape, blocksize=100000):
+        """
+        Encode the orthoIDs of ortholog records whose flat (column-major) matrix positions are given by keys.
+        Returns the store and a matrix of shape with the cell code of every cell.
+        blocksize: int -> OrthoIDs are split in blocks of this many records, so that the parts exist as strings only for one block
+        """
+        keep = keys >= 0
+        order = np.argsort(keys[keep], kind='stable')
+        keys = keys[keep][order]
+        genes = records.geneID.to_numpy(dtype=object)[keep][order]
+        orthoids = pd.Series(records.orthoID.to_numpy(dtype=object)[keep][order], dtype=object)
+        scores = records[['FAS_F', 'FAS_B']].to_numpy(dtype=float)[keep][order]
+
+        # cells
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype=np.int64)
+        indptr = np.r_[starts, len(keys)].astype(np.int64)
+        codes = np.zeros(shape[0] * shape[1], dtype=np.int32)
+        codes[keys[starts]] = np.arange(1, len(starts) + 1, dtype=np.int32)
+        gene_codes, gene_labels = pd.factorize(genes[starts])
+
+        # split orthoIDs into gene, species and rest
+        species2code, species_codes, rest, rest_lengths, raw = {}, [], [], [], []
+        for start in range(0, len(orthoids), blocksize):
+            block = orthoids.iloc[start:start + blocksize]
+            parts = block.str.split('|', n=2, expand=True).reindex(columns=range(3))
+            block_raw = (parts[0].to_numpy(dtype=object) != genes[start:start + blocksize]) | parts[2].isna().to_numpy()
+            codes_block, species_block = pd.factorize(parts[1].mask(block_raw, ''))
+            code_map = np.array([species2code.setdefault(name, len(species2code)) for name in species_block], dtype=np.int32)
+            species_codes.append(code_map[codes_block])
+            encoded = [value.encode() for value in np.where(block_raw, block, parts[2])]
+            rest.append(b''.join(encoded))
+            rest_lengths.append(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+            raw.append(block_raw)
+
+        store = cls(
+            genes=np.char.encode(np.asarray(gene_labels, dtype=str)),
+            cell_genes=gene_codes.astype(np.int32),
+            indptr=indptr,
+            species=np.char.encode(np.asarray(list(species2code), dtype=str)),
+            species_codes=np.concatenate(species_codes) if species_codes else np.zeros(0, dtype=np.int32),
+            rest=b''.join(rest),
+            rest_offsets=np.r_[0, np.cumsum(np.concatenate(rest_lengths) if rest_lengths else [])].astype(np.int64),
+            raw=np.concatenate(raw) if raw else np.zeros(0, dtype=bool),
+            scores=scores,
+        )
+        return store, codes.reshape(shape[::-1]).T
+
+    def __len__(self):
+        return len(self.rest_offsets) - 1
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays of the store"""
+        arrays = [self.genes, self.cell_genes, self.indptr, self.species, self.species_codes, self.rest_offsets, self.raw, self.scores]
+        return len(self.rest) + sum(array.nbytes for array in arrays)
+
+    def counts(self, codes):
+        """Number of orthologs in each cell of an array of cell codes"""
+        codes = np.asarray(codes)
+        n = np.r_[0, np.diff(self.indptr)]
+        return n[codes]
+
+    def ortholog_positions(self, codes):
+        """Return the positions of all orthologs stored in the cells of an array of codes, and the cell code of each ortholog"""
+        codes = np.asarray(codes).ravel()
+        codes = codes[codes > 0]
+        starts, ends = self.indptr[codes - 1], self.indptr[codes]
+        lengths = ends - starts
+        cell = np.repeat(codes, lengths)
+        positions = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+        return positions, cell
+
+    def decode(self, positions, cells):
+        """Rebuild the orthoIDs at positions (as returned by ortholog_positions) as an array of str"""
+        genes = self.genes[self.cell_genes[cells - 1]]
+        starts, ends = self.rest_offsets[positions].tolist(), self.rest_offsets[positions + 1].tolist()
+        rest = np.array([self.rest[start:end] for start, end in zip(starts, ends)], dtype=bytes)
+        joined = np.char.add(np.char.add(np.char.add(genes, b'|'), np.char.add(self.species[self.species_codes[positions]], b'|')), rest)
+        return np.char.decode(np.where(self.raw[positions], rest, joined))
+
+    def orthoids(self, code):
+        """Return the list of orthoIDs of a single cell code"""
+        if not code:
+            return []
+        positions, cells = self.ortholog_positions([code])
+        return self.decode(positions, cells).tolist()
+
+    def explode(self, matrix):
+        """Return one row per orthoID in a DataFrame of cell codes, with the columns geneID, ncbiID and orthoID"""
+        values = matrix.to_numpy()
+        rows, cols = np.nonzero(values)
+        positions, cells = self.ortholog_positions(values[rows, cols])
+        n = self.counts(values[rows, cols])
+        return pd.DataFrame({
+            'geneID': matrix.index.to_numpy()[np.repeat(rows, n)],
+            'ncbiID': matrix.columns.to_numpy()[np.repeat(cols, n)],
+            'orthoID': self.decode(positions, cells),
+        })
+
+    def records(self, matrix, blocksize=1000):
+        """
+        Return the ortholog records (geneID, ncbiID, orthoID, FAS_F, FAS_B) of a DataFrame of cell codes, gene by gene and
+        taxon by taxon like outmatrix_to_records. OrthoIDs are decoded in blocks of blocksize genes.
+        """
+        values = matrix.to_numpy()
+        taxa = matrix.columns.to_numpy(dtype=np.int64)
+        blocks = []
+        for start in range(0, max(len(values), 1), blocksize):
+            block = values[start:start + blocksize]
+            rows, cols = np.nonzero(block)
+            positions, cells = self.ortholog_positions(block[rows, cols])
+            n = self.counts(block[rows, cols])
+            blocks.append(pd.DataFrame({
+                'geneID': pd.Categorical.from_codes(np.repeat(rows + start, n), categories=matrix.index),
+                'ncbiID': taxa[np.repeat(cols, n)],
+                'orthoID': self.decode(positions, cells).astype(object),
+                'FAS_F': self.scores[positions, 0],
+                'FAS_B': self.scores[positions, 1],
+            }))
+        return pd.concat(blocks, ignore_index=True) if len(blocks) > 1 else blocks[0]
+
+    def to_lists(self, matrix, fillna=0):
+        """Convert a DataFrame of cell codes into a DataFrame with lists of orthoIDs, as loaded without compact storage"""
+        values = matrix.to_numpy()
+        positions, cells = self.ortholog_positions(values)
+        return self._cell_lists(matrix, self.decode(positions, cells).tolist(), fillna)
+
+    def to_outmatrix(self, matrix, fillna=0):
+        """Convert a DataFrame of cell codes into an outmatrix with lists of (orthoID, FAS_F, FAS_B) tuples, as loaded without compact storage"""
+        values = matrix.to_numpy()
+        positions, cells = self.ortholog_positions(values)
+        entries = list(zip(self.decode(positions, cells).tolist(), *self.scores[positions].T.tolist()))
+        return self._cell_lists(matrix, entries, fillna)
+
+    def _cell_lists(self, matrix, decoded, fillna):
+        """Split the entries of all orthologs of a DataFrame of cell codes (in the order of ortholog_positions) into one list per cell"""
+        values = matrix.to_numpy()
+        out = np.empty(values.size, dtype=object)
+        out[:] = fillna
+        filled = np.flatnonzero(values.ravel())
+        bounds = np.r_[0, np.cumsum(self.counts(values.ravel()[filled]))]
+        for i, start, end in zip(filled, bounds[:-1], bounds[1:]):
+            out[i] = decoded[start:end]
+        return pd.DataFrame(out.reshape(values.shape), index=matrix.index, columns=matrix.columns)
+
+
+class CompactOutmatrix():
+    """
+    Outmatrix of a compact orthoID profile. The (orthoID, FAS_F, FAS_B) tuples of the cells are decoded from the
+    OrthoIDStore when they are needed, instead of being kept as Python objects next to the store.
+    codes: DataFrame -> Cell codes into the store (genes x taxa)
+    """
+    def __init__(self, store, codes, fillna=0):
+        self.store = store
+        self.codes = codes
+        self.fillna = fillna
+
+    @property
+    def index(self):
+        return self.codes.index
+
+    @property
+    def columns(self):
+        return self.codes.columns
+
+    def apply(self, func):
+        """Return a CompactOutmatrix of func applied to the cell codes, e.g. a selection or reordering of genes and taxa"""
+        return CompactOutmatrix(self.store, func(self.codes), self.fillna)
+
+    def counts(self):
+        """Number of orthologs in each cell"""
+        return pd.DataFrame(self.store.counts(self.codes.to_numpy()), index=self.codes.index, columns=self.codes.columns)
+
+    def records(self):
+        """Ortholog records of all cells (see OrthoIDStore.records)"""
+        return self.store.records(self.codes)
+
+    def to_frame(self):
+        """The outmatrix with lists of (orthoID, FAS_F, FAS_B) tuples"""
+        return self.store.to_outmatrix(self.codes, self.fillna)
@@ -0,0 +1,116 @@
+import logging
+import numpy as np
+import pandas as pd
+from xml.sax.saxutils import quoteattr
+from PhyloProPy.indexing import taxon_to_int
+from PhyloProPy.compression import open_text
+
+
+def taxon_positions(records, taxa):
+    """Position of the taxon of each ortholog record in taxa"""
+    return pd.Index([taxon_to_int(taxon) for taxon in taxa]).get_indexer(records.ncbiID.to_numpy())
+
+
+def gene_ids(positions, first):
+    """
+    OrthoXML gene ids of gene by gene ortholog records. Ids are numbered taxon by taxon, each taxon starting from its
+    first id, so the ids follow from the taxon positions of the records and the number of orthologs per taxon.
+    """
+    order = np.argsort(positions, kind='stable')
+    ordered = positions[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    ids = np.empty(len(order), dtype=np.int64)
+    ids[order] = first[ordered] + rank
+    return ids
+
+
+def write_orthoxml(path, records, taxa, taxid2name=None, database='fDOG', compression='infer', threads=1, chunksize=10000):
+    """
+    Write ortholog records (geneID, ncbiID, orthoID, FAS_F, FAS_B), ordered gene by gene, to an OrthoXML 0.3 file.
+    Each gene becomes one orthologGroup, each taxon of taxa one species.
+    """
+    positions = taxon_positions(records, taxa)
+    order = np.argsort(positions, kind='stable')
+    # ids are numbered taxon by taxon, i.e. in the order of the species section
+    ids = np.empty(len(order), dtype=np.int64)
+    ids[order] = np.arange(1, len(order) + 1)
+    orthoids = records.orthoID.to_numpy()
+    blocksize = 10 * chunksize
+
+    def species():
+        for start in range(0, len(order), blocksize):
+            block = order[start:start + blocksize]
+            yield from zip(positions[block].tolist(), orthoids[block].tolist())
+
+    groups = (records.iloc[start:start + blocksize].assign(id=ids[start:start + blocksize]) for start in range(0, len(records), blocksize))
+    write_orthoxml_sections(path, taxa, species(), groups, taxid2name, database, compression, threads, chunksize)
+
+
+def write_orthoxml_sections(path, taxa, species, groups, taxid2name=None, database='fDOG', compression='infer', threads=1, chunksize=10000):
+    """
+    Stream the species and the ortholog groups to an OrthoXML 0.3 file. Nothing but the XML text of chunksize elements
+    and the current block of groups is held in memory, so the output size is not limited by RAM.
+    species: iterable -> (taxon position in taxa, orthoID) of all orthologs, taxon by taxon. Gene ids are numbered 1, 2, ... in this order
+    groups: iterable -> Blocks of ortholog records with their gene id (column id), gene by gene
+    """
+    logger = logging.getLogger('phyloprofile')
+    taxid2name = taxid2name or {}
+
+    with open_text(path, 'w', compression=compression, threads=threads) as of:
+        of.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        of.write('<orthoXML xmlns="http://orthoXML.org/2011/" version="0.3" origin="PhyloProPy" originVersion="0.1">\n')
+
+        # species and genes
+        buffer = []
+        current = None
+        for gene_id, (position, orthoid) in enumerate(species, 1):
+            if position != current:
+                if current is not None:
+                    buffer.append('      </genes>\n    </database>\n  </species>\n')
+                current = position
+                taxon = taxa[position]
+                taxid = taxon_to_int(taxon)
+                name = taxid2name.get(taxid, str(taxon))
+                buffer.append(f'  <species name={quoteattr(name)} NCBITaxId="{taxid}">\n')
+                buffer.append(f'    <database name={quoteattr(database)} version="1">\n      <genes>\n')
+            buffer.append(f'        <gene id="{gene_id}" protId={quoteattr(str(orthoid))}/>\n')
+            if len(buffer) >= chunksize:
+                of.write(''.join(buffer))
+                buffer = []
+        if current is not None:
+            buffer.append('      </genes>\n    </database>\n  </species>\n')
+        of.write(''.join(buffer))
+
+        # scores
+        of.write('  <scores>\n')
+        of.write('    <scoreDef id="FAS_F" desc="FAS score from the seed to the ortholog (forward)"/>\n')
+        of.write('    <scoreDef id="FAS_B" desc="FAS score from the ortholog to the seed (backward)"/>\n')
+        of.write('  </scores>\n')
+
+        # ortholog groups
+        of.write('  <groups>\n')
+        orthologs, n_groups = 0, 0
+        current = None
+        for block in groups:
+            buffer = []
+            for gene, gene_id, fasf, fasb in zip(block.geneID.tolist(), block.id.tolist(), block.FAS_F.tolist(), block.FAS_B.tolist()):
+                if gene != current:
+                    if current is not None:
+                        buffer.append('    </orthologGroup>\n')
+                    current = gene
+                    n_groups += 1
+                    buffer.append(f'    <orthologGroup id={quoteattr(str(gene))}>\n')
+                buffer.append(
+                    f'      <geneRef id="{gene_id}">'
+                    f'<score id="FAS_F" value="{fasf}"/><score id="FAS_B" value="{fasb}"/></geneRef>\n'
+                )
+                if len(buffer) >= chunksize:
+                    of.write(''.join(buffer))
+                    buffer = []
+            of.write(''.join(buffer))
+            orthologs += len(block)
+        if current is not None:
+            of.write('    </orthologGroup>\n')
+        of.write('  </groups>\n</orthoXML>\n')
+    logger.info(f'Wrote {orthologs} orthologs in {n_groups} groups to {path}')
@@ -0,0 +1,335 @@
+import heapq
+import json
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PhyloProPy.PhyloProfile import PhyloProfile
+from PhyloProPy.compression import open_text
+from PhyloProPy.load_phyloprofile import iter_phyloprofile_records, matrix_dtype, phyloprofile2matrix, sort_phyloprofile, write_records, PHYLOPROFILE_COLUMNS
+from PhyloProPy.logger import phyloprofile_logger
+from PhyloProPy.mapping import check_taxonomy_input, taxa_to_rank
+from PhyloProPy.orthoxml import gene_ids, taxon_positions, write_orthoxml_sections
+from PhyloProPy.profile_stats import collapse_matrix
+from PhyloProPy.indexing import taxon_to_int, selection
+from PhyloProPy.progress import LoadProgress
+from PhyloProPy.taxonomy import open_taxonomy, taxonomy_path
+
+
+MANIFEST = 'manifest.json'
+
+
+def gene_partitions(genes, partitions):
+    """Assign genes to partitions with a hash that is stable across processes and runs"""
+    genes = pd.Series(genes, dtype=object)
+    return (pd.util.hash_pandas_object(genes, index=False).to_numpy() % partitions).astype(int)
+
+
+def partition_phyloprofile(path, workdir, partitions=16, from_custom=False, threads=1, chunksize=1000000, progress=None, cancel=None):
+    """
+    Split a phyloprofile file into gene-partitioned phyloprofile files in workdir, streaming it in blocks of chunksize lines.
+    All orthologs of a gene end up in the same partition. Writes and returns a manifest with the partition files,
+    the genes of each partition and the taxa in order of their first appearance.
+    progress: callable -> Called with a dict of the progress after every block (see LoadProgress)
+    cancel: CancelToken -> Stops with LoadCancelled at the next block. No manifest is written
+    """
+    logger = logging.getLogger('phyloprofile')
+    logger.info(f'Splitting {path} into {partitions} gene partitions in {workdir}')
+    os.makedirs(workdir, exist_ok=True)
+    files = [f'part-{i:05d}.phyloprofile' for i in range(partitions)]
+    genes = [dict() for _ in range(partitions)]
+    taxa = dict()
+    tracker = LoadProgress(path, progress, cancel)
+    handles = [open_text(os.path.join(workdir, name), 'w', compression=None) for name in files]
+    try:
+        for handle in handles:
+            handle.write('geneID\tncbiID\torthoID\tFAS_F\tFAS_B\n')
+        for records in iter_phyloprofile_records(path, from_custom, threads=threads, chunksize=chunksize, progress=tracker):
+            taxa.update(dict.fromkeys(pd.unique(records.ncbiID).tolist()))
+            parts = gene_partitions(records.geneID, partitions)
+            for part, part_records in records.groupby(parts, sort=False):
+                genes[part].update(dict.fromkeys(pd.unique(part_records.geneID)))
+                write_records(handles[part], part_records, header=False)
+    finally:
+        for handle in handles:
+            handle.close()
+
+    manifest = {
+        'source': os.path.abspath(str(path)),
+        'partitions': files,
+        'genes': [list(part_genes) for part_genes in genes],
+        'taxa': list(taxa),
+    }
+    with open(os.path.join(workdir, MANIFEST), 'w') as of:
+        json.dump(manifest, of)
+    tracker.update(stage='done')
+    return manifest
+
+
+def _partition_profile(path, style, taxa, load_args, ops):
+    """Load one partition in a worker and apply the queued operations. Workers do not need the NCBI taxonomy."""
+    matrix, outmatrix, orthoids = phyloprofile2matrix(path, None, style, False, reference='', compact=False, **load_args)
+    fillna = load_args['fillna']
+    pp = PhyloProfile.__new__(PhyloProfile)
+    pp.ncbi = None
+    pp.matrix = matrix.reindex(columns=taxa, fill_value=fillna)
+    dtype = matrix_dtype(style, fillna)
+    if dtype is not None and (matrix.dtypes == dtype).all():
+        # taxa without orthologs in this partition are added as int64 columns, keep the compact dtype of the loaded matrix
+        pp.matrix = pp.matrix.astype(dtype)
+    pp.outmatrix = outmatrix.reindex(columns=taxa, fill_value=fillna)
+    pp.orthoids = orthoids
+    pp.style = style
+    pp._index = None
+    pp._summary = None
+    pp._presence = None
+    for op, args in ops:
+        if op == 'filter':
+            pp.filter_profile(*args)
+        elif op == 'binary':
+            pp.to_binary()
+    return pp
+
+
+def _run_partition(task, args, path, style, taxa, load_args, ops):
+    """Run a task on a single partition. Module-level so that it can be sent to worker processes."""
+    pp = _partition_profile(path, style, taxa, load_args, ops)
+    if task == 'matrix':
+        return pp.matrix
+    elif task == 'outmatrix':
+        return pp.outmatrix
+    elif task == 'slice':
+        return pp.slice(*args)
+    elif task == 'genes':
+        return list(pp.genes())
+    elif task == 'gene_stats':
+        return pp.gene_stats()
+    elif task == 'collapse':
+        taxid2group, how = args
+        return collapse_matrix(pp._numeric_matrix(), taxid2group, how)
+    elif task == 'records':
+        return pp._records()
+    elif task == 'orthoxml_species':
+        # orthoIDs sorted taxon by taxon (gene order kept within a taxon) for merging the species of all partitions
+        directory, = args
+        records = pp._records()
+        positions = taxon_positions(records, taxa)
+        order = np.argsort(positions, kind='stable')
+        with open(os.path.join(directory, os.path.basename(path) + '.species'), 'w') as of:
+            of.writelines(f'{position}\t{orthoid}\n' for position, orthoid in zip(positions[order].tolist(), records.orthoID.to_numpy()[order].tolist()))
+        return np.bincount(positions, minlength=len(taxa))
+    else:
+        raise ValueError(f'Unknown partition task "{task}"')
+
+
+class PartitionedPhyloProfile(PhyloProfile):
+    """
+    Out-of-core PhyloProfile. The phyloprofile file is split into gene-partitioned phyloprofile files, which are
+    loaded and processed one by one by a pool of workers. Filtering and binarization are queued and applied when a
+    partition is loaded, statistics and collapsed matrices are computed per partition and concatenated.
+    Accessing matrix or outmatrix materializes the full profile in memory. The materialized frames are kept until
+    filtering, binarization or reordering change the profile, so that methods inherited from PhyloProfile and their
+    caches work on the same frames.
+    Created with PhyloProfile(path, backend='partitioned', ...).
+    """
+    def __init__(
+        self, path='', style='fasf', from_custom=False, fasF_filter=0.0, fasB_filter=0.0, fillna=0, resolve_coorthologs=True, reference='', threads=1, compact=True, debug=False, silent=False,
+        backend='partitioned', progress=None, cancel=None, taxonomy=None, partitions=16, workdir=None, workers=None, scheduler='processes',
+    ):
+        """
+        Accepts the arguments of PhyloProfile. With style 'orthoid', cells hold lists of orthoIDs (compact is ignored). progress and cancel cover splitting the file into partitions.
+        path: str -> phyloprofile file, or a workdir with a manifest of an earlier partitioned run to reuse its partitions
+        partitions: int -> Number of gene partitions
+        workdir: str -> Directory for the partition files. Defaults to a temporary directory that is removed with the object
+        workers: int -> Number of worker processes/threads. Defaults to the number of CPUs
+        scheduler: ['processes', 'threads', 'synchronous', 'dask'] -> How partitions are processed. 'dask' uses the current dask scheduler
+        """
+        logger = phyloprofile_logger(debug=debug, silent=silent)
+        if not path:
+            logger.info('No path specified. Loading example phyloprofile')
+            path = os.path.dirname(__file__) + '/data/medium.phyloprofile'
+        self.ncbi = open_taxonomy(taxonomy, path)
+
+        if os.path.isdir(path) and os.path.isfile(os.path.join(path, MANIFEST)):
+            workdir = path
+            with open(os.path.join(workdir, MANIFEST)) as fh:
+                manifest = json.load(fh)
+        else:
+            if workdir is None:
+                workdir = tempfile.mkdtemp(prefix='phyloprofile_')
+                self._cleanup = weakref.finalize(self, shutil.rmtree, workdir, ignore_errors=True)
+            manifest = partition_phyloprofile(path, workdir, partitions, from_custom=from_custom, threads=threads, progress=progress, cancel=cancel)
+
+        self.workdir = workdir
+        self.workers = workers or os.cpu_count()
+        self.scheduler = scheduler
+        self.style = style
+        self.orthoids = None
+        self._index = None
+        self._summary = None
+        self._presence = None
+        self._paths = [os.path.join(workdir, name) for name in manifest['partitions']]
+        self._genes = manifest['genes']
+        self._active = [i for i, genes in enumerate(self._genes) if genes]
+        self._taxa = [taxon_to_int(taxon) for taxon in manifest['taxa']]
+        self._load_args = dict(fasF_filter=fasF_filter, fasB_filter=fasB_filter, fillna=fillna, resolve_coorthologs=resolve_coorthologs)
+        self._ops = []
+        self._frames = {}
+        if reference:
+            _, self._taxa = sort_phyloprofile(pd.DataFrame(columns=self._taxa), self.ncbi, reference)
+
+    def _map(self, task, args=(), parts=None):
+        """Run a task on partitions (default: all non-empty partitions) with the configured scheduler and return the results in partition order"""
+        parts = self._active if parts is None else parts
+        calls = [(task, args, self._paths[part], self.style, self._taxa, self._load_args, list(self._ops)) for part in parts]
+        if self.scheduler == 'synchronous' or len(calls) <= 1:
+            return [_run_partition(*call) for call in calls]
+        elif self.scheduler == 'processes':
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                return list(executor.map(_run_partition, *zip(*calls)))
+        elif self.scheduler == 'threads':
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return list(executor.map(_run_partition, *zip(*calls)))
+        elif self.scheduler == 'dask':
+            import dask
+            return list(dask.compute(*[dask.delayed(_run_partition)(*call) for call in calls]))
+        else:
+            raise ValueError(f'Unknown scheduler "{self.scheduler}". Choose "processes", "threads", "synchronous" or "dask"')
+
+    def _parts_of(self, genes):
+        """Return the active partitions that can contain genes"""
+        parts = set(gene_partitions(list(genes), len(self._paths))) if len(genes) else set()
+        return [part for part in self._active if part in parts]
+
+    @staticmethod
+    def _concat(frames):
+        frames = [frame for frame in frames if frame is not None]
+        return pd.concat(frames) if frames else pd.DataFrame()
+
+    def _materialize(self, task):
+        """Assemble the full matrix or outmatrix from all partitions, once until the profile changes"""
+        if task not in self._frames:
+            self._frames[task] = self._concat(self._map(task))
+        return self._frames[task]
+
+    @property
+    def matrix(self):
+        """The full matrix, assembled from all partitions"""
+        return self._materialize('matrix')
+
+    @property
+    def outmatrix(self):
+        """The full outmatrix, assembled from all partitions"""
+        return self._materialize('outmatrix')
+
+    def _records(self):
+        """Ortholog records of all partitions"""
+        return pd.concat(self._map('records'), ignore_index=True)
+
+    def filter_profile(self, genes=None, taxa=None):
+        """Filter the the PhyloProfile based on a list of genes or taxids. Applied to each partition when it is loaded."""
+        genes, taxa = selection(genes), selection(taxa)
+        if genes is None and taxa is None:
+            return
+        if genes is not None:
+            self._active = self._parts_of(genes)
+        if taxa is not None:
+            taxids = {taxon_to_int(taxon) for taxon in taxa}
+            self._taxa = [taxon for taxon in self._taxa if taxon_to_int(taxon) in taxids]
+        self._ops.append(('filter', (genes, taxa)))
+        self._frames = {}
+
+    def to_binary(self):
+        self._ops.append(('binary', ()))
+        self.style = 'binary'
+        self._frames = {}
+
+    def slice(self, genes=None, taxa=None):
+        """Return a DataFrame slice of a PhyloProfile. Only partitions containing the genes are loaded."""
+        genes, taxa = selection(genes), selection(taxa)
+        parts = self._parts_of(genes) if genes is not None else None
+        df = self._concat(self._map('slice', (genes, taxa), parts))
+        if genes is not None and len(df):
+            df = df.loc[[gene for gene in dict.fromkeys(genes) if gene in df.index]]
+        return df
+
+    def lineage_slice(self, lineage):
+        """Return a DataFrame containing only taxa in lineage"""
+        input = check_taxonomy_input(lineage, self.ncbi)
+        if not input:
+            logger = logging.getLogger('phyloprofile')
+            logger.error(f'Could not find "{lineage}" in the NCBI Taxonomy')
+            return None
+        return self.slice(taxa=self.ncbi.get_descendant_taxa(input))
+
+    def set_reference(self, reference):
+        _, self._taxa = sort_phyloprofile(pd.DataFrame(columns=self._taxa), self.ncbi, reference)
+        self._frames = {}
+
+    def genes(self):
+        if not any(op == 'filter' for op, _ in self._ops):
+            return pd.Index([gene for part in self._active for gene in self._genes[part]])
+        return pd.Index([gene for genes in self._map('genes') for gene in genes])
+
+    def taxa(self, return_as='int'):
+        if return_as == 'int':
+            return list(self._taxa)
+
+    def gene_stats(self):
+        """Return per-gene statistics, computed partition by partition"""
+        return self._concat(self._map('gene_stats'))
+
+    def collapse(self, rank='phylum', how='max'):
+        """Return the matrix with taxa collapsed to their ancestor at rank, computed partition by partition"""
+        taxid2group = taxa_to_rank(self.taxa(), rank, self.ncbi)
+        return self._concat(self._map('collapse', (taxid2group, how))).fillna(0)
+
+    def write_csv(self, path='./output.phyloprofile', compression='infer', threads=1, taxonomy=False):
+        """
+        Write the stored orthologs to a phyloprofile file. Only as many partitions as there are workers are held in memory at a time.
+        taxonomy: bool -> Also save a taxonomy snapshot of the taxa next to the file, which is used when the file is loaded again
+        """
+        with open_text(path, 'w', compression=compression, threads=threads) as of:
+            write_records(of, pd.DataFrame(columns=PHYLOPROFILE_COLUMNS))
+            for start in range(0, len(self._active), self.workers):
+                for records in self._map('records', parts=self._active[start:start + self.workers]):
+                    write_records(of, records, header=False)
+        if taxonomy:
+            self.write_taxonomy(taxonomy_path(path))
+
+    def write_orthoxml(self, path='./output.orthoxml', database='fDOG', names=True, compression='infer', threads=1):
+        """
+        Write the stored orthologs to an OrthoXML file. The orthologs of each partition are sorted by taxon into a file in
+        the workdir, and these files are merged into the species of the OrthoXML file. The ortholog groups are written
+        partition by partition, so only as many partitions as there are workers are held in memory at a time.
+        """
+        taxid2name = self.ncbi.get_taxid_translator(self._taxa) if names else {}
+        directory = tempfile.mkdtemp(prefix='orthoxml_', dir=self.workdir)
+        try:
+            counts = np.array(self._map('orthoxml_species', (directory,)), dtype=np.int64).reshape(len(self._active), len(self._taxa))
+            # ids are numbered taxon by taxon and within a taxon partition by partition
+            totals = counts.sum(axis=0)
+            first = np.cumsum(totals) - totals + 1 + np.cumsum(counts, axis=0) - counts
+
+            def species():
+                handles = [open(os.path.join(directory, os.path.basename(self._paths[part]) + '.species')) for part in self._active]
+                try:
+                    for line in heapq.merge(*handles, key=lambda line: int(line[:line.index('\t')])):
+                        position, orthoid = line.rstrip('\n').split('\t', 1)
+                        yield int(position), orthoid
+                finally:
+                    for handle in handles:
+                        handle.close()
+
+            def groups():
+                for start in range(0, len(self._active), self.workers):
+                    for i, records in enumerate(self._map('records', parts=self._active[start:start + self.workers]), start):
+                        yield records.assign(id=gene_ids(taxon_positions(records, self._taxa), first[i]))
+
+            write_orthoxml_sections(path, self._taxa, species(), groups(), taxid2name, database=database, compression=compression, threads=threads)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
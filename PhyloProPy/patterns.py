@@ -0,0 +1,165 @@
+import numpy as np
+
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount_rows(bits):
+    """Number of set bits in each row of a bit-packed uint8 array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int64)
+    return POPCOUNT[bits].sum(axis=1, dtype=np.int64)
+
+
+class PresenceIndex():
+    """
+    Bit-packed presence/absence index of a profile. Each gene is a row of bits (one per taxon), each lineage a
+    precomputed bit mask over the same taxa. Counting the taxa of a lineage with orthologs of every gene is one
+    bitwise AND and a popcount over the packed rows.
+    """
+    def __init__(self, matrix, membership, blocksize=1024):
+        self.genes = matrix.index
+        self.bits = np.packbits(matrix.to_numpy() > 0, axis=1)
+        self.membership = membership
+        self.sizes = membership.sizes.to_numpy()
+
+        # lineage masks, packed in blocks of lineages to bound the size of the dense intermediate
+        lineage_taxa = membership.matrix.T.tocsr()
+        blocks = []
+        for start in range(0, lineage_taxa.shape[0], blocksize):
+            dense = lineage_taxa[start:start + blocksize].toarray() > 0
+            blocks.append(np.packbits(dense, axis=1))
+        self.masks = np.concatenate(blocks) if blocks else np.zeros((0, self.bits.shape[1]), dtype=np.uint8)
+
+    def counts(self, lineage, rows=None):
+        """Number of taxa of a lineage (taxid) with orthologs, for each gene (or for the genes at positions rows)"""
+        mask = self.masks[self.membership.lineages.get_loc(lineage)]
+        # only the bytes that contain taxa of the lineage are read
+        columns = np.flatnonzero(mask)
+        bits = self.bits[:, columns] if rows is None else self.bits[np.ix_(rows, columns)]
+        return popcount_rows(bits & mask[columns])
+
+    def query(self, present_in=(), absent_from=(), min_fraction=1.0, max_fraction=0.0):
+        """
+        Return the genes with orthologs in at least min_fraction of the taxa (but at least one) of every lineage in
+        present_in, and in at most max_fraction of the taxa of every lineage in absent_from. Lineages are taxids.
+        Each condition is only evaluated for the genes that passed the previous ones.
+        """
+        rows = np.arange(len(self.genes))
+        for lineage in present_in:
+            size = self.sizes[self.membership.lineages.get_loc(lineage)]
+            rows = rows[self.counts(lineage, rows) >= max(1, np.ceil(min_fraction * size - 1e-9))]
+        for lineage in absent_from:
+            size = self.sizes[self.membership.lineages.get_loc(lineage)]
+            rows = rows[self.counts(lineage, rows) <= np.floor(max_fraction * size + 1e-9)]
+        return self.genes[rows]
+
+    def jaccard(self, row):
+        """Jaccard similarity of the taxa with orthologs of the gene at position row to those of every gene"""
+        sizes = popcount_rows(self.bits)
+        shared = popcount_rows(self.bits & self.bits[row])
+        union = sizes + sizes[row] - shared
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(union > 0, shared / union, 0.0)
+
+
+def unique_rows(values, decimals=None):
+    """
+    Group identical rows of a 2D array, optionally after rounding (quantising scores) to decimals.
+    Returns the unique rows in order of first appearance, the index of the unique row of every row and the
+    multiplicity of every unique row.
+    """
+    values = np.asarray(values, dtype=float)
+    if decimals is not None:
+        values = np.round(values, decimals)
+    patterns, first, inverse, counts = np.unique(values, axis=0, return_index=True, return_inverse=True, return_counts=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return patterns[order], rank[inverse.ravel()], counts[order]
+
+
+def expand_order(pattern_order, inverse):
+    """Turn an order of unique patterns into an order of all rows. Rows with the same pattern stay together in their original order."""
+    rank = np.empty(len(pattern_order), dtype=np.int64)
+    rank[pattern_order] = np.arange(len(pattern_order))
+    return np.argsort(rank[inverse], kind='stable')
+
+
+def pattern_linkage(patterns, counts, method='average', metric='euclidean'):
+    """
+    Hierarchical clustering of unique patterns that gives the tree of clustering all rows, in which identical rows
+    are merged first at distance 0. For 'single', 'complete', 'weighted' and 'median' the multiplicities do not
+    matter. For 'average', 'centroid' and 'ward' the patterns start as clusters of their multiplicity, and the
+    Lance-Williams updates run in numpy on the pattern x pattern distance matrix (scipy's linkage takes no weights).
+    Returns a scipy linkage matrix over the patterns (cluster sizes count patterns, not rows).
+    Without tied distances, the tree equals that of clustering all rows with scipy (the leaf order only up to
+    swapped siblings). Ties (frequent in binary profiles) are broken towards the lowest pattern, which can merge
+    tied clusters in another order than scipy and thereby give a different, equally valid tree.
+    """
+    from scipy.cluster.hierarchy import linkage
+    from scipy.spatial.distance import pdist, squareform
+
+    counts = np.asarray(counts, dtype=float)
+    if method in ['single', 'complete', 'weighted', 'median'] or np.all(counts == 1):
+        return linkage(patterns, method=method, metric=metric)
+    if method not in ['average', 'centroid', 'ward']:
+        raise ValueError(f'Unknown linkage method "{method}"')
+
+    m = len(patterns)
+    squared = method in ['centroid', 'ward']
+    D = squareform(pdist(patterns, metric)) ** (2 if squared else 1)
+    if method == 'ward':
+        # Ward distance between clusters of ni and nj identical rows
+        D *= counts[:, None]
+        D *= counts[None, :]
+        D /= np.add.outer(counts, counts) / 2
+    np.fill_diagonal(D, np.inf)
+    size = counts.copy()
+    leaves = np.ones(m, dtype=np.int64)
+    ids = np.arange(m)
+    row_arg = np.argmin(D, axis=1)
+    row_min = D[np.arange(m), row_arg]
+    Z = np.zeros((m - 1, 4))
+    for step in range(m - 1):
+        i = int(np.argmin(row_min))
+        j = int(row_arg[i])
+        dij, ni, nj = D[i, j], size[i], size[j]
+        if method == 'average':
+            new = (ni * D[i] + nj * D[j]) / (ni + nj)
+        elif method == 'centroid':
+            new = (ni * D[i] + nj * D[j]) / (ni + nj) - ni * nj * dij / (ni + nj) ** 2
+        else:
+            new = ((ni + size) * D[i] + (nj + size) * D[j] - size * dij) / (ni + nj + size)
+        new[size == 0] = np.inf
+        new[[i, j]] = np.inf
+        Z[step] = [min(ids[i], ids[j]), max(ids[i], ids[j]), np.sqrt(max(dij, 0)) if squared else dij, leaves[i] + leaves[j]]
+
+        # cluster i becomes the merged cluster, j is removed
+        D[i, :], D[:, i] = new, new
+        D[j, :], D[:, j] = np.inf, np.inf
+        size[i], size[j] = ni + nj, 0
+        leaves[i] += leaves[j]
+        ids[i] = m + step
+        row_min[j] = np.inf
+
+        # rows whose nearest neighbour was merged are searched again, all others only compare with the new cluster
+        stale = np.flatnonzero(((row_arg == i) | (row_arg == j)) & (size > 0))
+        closer = new < row_min
+        row_min[closer], row_arg[closer] = new[closer], i
+        stale = np.union1d(stale, [i])
+        row_arg[stale] = np.argmin(D[stale], axis=1)
+        row_min[stale] = D[stale, row_arg[stale]]
+    return Z
+
+
+def weighted_pca(X, counts, n_components=2):
+    """PCA of rows X with multiplicities counts. Equal to PCA of the rows repeated counts times (signs as in scikit-learn)."""
+    X = np.asarray(X, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    mean = counts @ X / counts.sum()
+    centered = X - mean
+    _, _, Vt = np.linalg.svd(np.sqrt(counts)[:, None] * centered, full_matrices=False)
+    Vt = Vt[:n_components]
+    signs = np.sign(Vt[np.arange(len(Vt)), np.argmax(np.abs(Vt), axis=1)])
+    return centered @ (Vt * signs[:, None]).T
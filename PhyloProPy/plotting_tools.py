@@ -5,10 +5,17 @@ from collections import Counter
 import logging
 
 
-def phylo_heatmap(df, clustermethod, **kwargs):
+def phylo_heatmap(df, clustermethod, deduplicate=True, decimals=None, **kwargs):
+    """
+    Heatmap of a profile with rows ordered by hierarchical clustering.
+    deduplicate: bool -> Cluster the unique row patterns weighted by their multiplicity instead of all rows. Gives the same tree
+        unless distances are tied (see pattern_linkage)
+    decimals: int -> Round scores to decimals before finding unique patterns (only with deduplicate)
+    """
     import plotly.express as px
     from plotly.colors import label_rgb
     from scipy.cluster.hierarchy import linkage, leaves_list
+    from PhyloProPy.patterns import unique_rows, pattern_linkage, expand_order
     
     color_map= [
         [0.0, 'white'],
@@ -17,12 +24,19 @@ def phylo_heatmap(df, clustermethod, **kwargs):
     ]
 
     # clustering
-    if clustermethod:
-        row_linkage = linkage(df, method=clustermethod)
-        row_order = leaves_list(row_linkage)
+    ordered_df = df
+    if clustermethod and len(df) > 1:
+        if deduplicate:
+            patterns, inverse, counts = unique_rows(df.to_numpy(), decimals=decimals)
+            if len(patterns) > 1:
+                row_order = expand_order(leaves_list(pattern_linkage(patterns, counts, method=clustermethod)), inverse)
+            else:
+                row_order = np.arange(len(df))
+        else:
+            row_order = leaves_list(linkage(df, method=clustermethod))
         ordered_df = df.iloc[row_order, :]
     
-    fig = px.imshow(df, color_continuous_scale=color_map, aspect="auto", **kwargs)
+    fig = px.imshow(ordered_df, color_continuous_scale=color_map, aspect="auto", **kwargs)
 
     return fig
 
@@ -56,19 +70,10 @@ def retrieve_taxa_mapping(taxids4download, taxlevel, ncbi, update_taxonomy):
     return taxid2name, taxid2lineage, taxid2levelname
 
 
-def dimension_reduced_phyloprofile(
-    df, taxlevel, ncbi,
-    update_taxonomy, method, jitter, scaler, transpose, seed, n_components=2,
-    **kwargs
-):
-    """
-    Take a 2D representation of a phylogenetic profile and apply dimensionality reduction
-    """
-    
-    
+def scale_matrix(df, scaler):
+    """Scale the columns of a matrix. scaler: ['StandardScaler', 'RobustScaler', 'QuantileTransformer', 'None']"""
     from sklearn.preprocessing import StandardScaler, RobustScaler, QuantileTransformer
-    
-    logger = logging.getLogger('phyloprofile')
+
     # Convert string scaler to actual scaler object
     scaler_mapping = {
         'StandardScaler': StandardScaler(),
@@ -77,17 +82,32 @@ def dimension_reduced_phyloprofile(
         'None': None
     }
     scaler = scaler_mapping[scaler]
-    
-    # Standardize the features
-    if transpose:
-        df = df.transpose()
+    # compact float32/uint8 matrices are embedded in double precision
+    values = np.asarray(df, dtype=float)
     if scaler:
-        scaled_data = scaler.fit_transform(df)
-    else:
-        scaled_data = df
+        return scaler.fit_transform(values)
+    return values
+
+
+def reduce_dimensions(scaled_data, method, seed, n_components=2, deduplicate=False, decimals=None):
+    """
+    Embed the rows of a (scaled) matrix with a dimensionality reduction method: ['umap', 'PCA', 'tSNE', 'MDS']
+    deduplicate: bool -> Reduce only the unique row patterns and give identical rows the coordinates of their pattern.
+        Exact for PCA (weighted by multiplicity), an approximation for tSNE, MDS and umap
+    decimals: int -> Round values to decimals before finding unique patterns (only with deduplicate)
+    """
+    from PhyloProPy.patterns import unique_rows, weighted_pca
+
+    logger = logging.getLogger('phyloprofile')
+    inverse = None
+    if deduplicate:
+        scaled_data, inverse, counts = unique_rows(scaled_data, decimals=decimals)
+        logger.info(f'Reducing {len(scaled_data)} unique patterns of {len(inverse)} rows')
 
     # reduce dimensions
-    if method == 'PCA':
+    if method == 'PCA' and deduplicate:
+        result = weighted_pca(scaled_data, counts, n_components=n_components)
+    elif method == 'PCA':
         from sklearn.decomposition import PCA
         pca = PCA(n_components=n_components)
         result = pca.fit_transform(scaled_data)
@@ -105,34 +125,146 @@ def dimension_reduced_phyloprofile(
         result = reducer.fit_transform(scaled_data)
     else:
         raise ValueError(f'Unknown method "{method}". Choose "PCA" or "tSNE"')
-        
-    # store result in dataframe
-    red_df = pd.DataFrame(data=result, columns=[f'PC{i}' for i in range(1, n_components+1)])
-    if all(s.startswith('ncbi') for s in df.index):
+    if inverse is not None:
+        result = result[inverse]
+    return result
+
+
+def embedding_labels(df, taxlevel, ncbi, update_taxonomy):
+    """Labels of the rows of an embedded matrix: taxid, species name, sum and clade at taxlevel for taxa, or gene and sum for genes"""
+    logger = logging.getLogger('phyloprofile')
+    labels = pd.DataFrame(index=range(len(df)))
+    # taxa are labelled by integer taxids, genes by strings
+    if pd.api.types.is_integer_dtype(df.index):
         logger.info(f'Generating labels on "{taxlevel}" level')
-        taxids4download = [taxid.replace('ncbi', '') for taxid in df.index]
+        taxids4download = df.index.tolist()
         taxid2name, taxid2lineage, taxid2levelname = retrieve_taxa_mapping(taxids4download, taxlevel, ncbi, update_taxonomy)
         # assign labels
-        red_df['taxid'] = [taxid.replace('ncbi', '') for taxid in df.index]
-        red_df['species'] = red_df.taxid.apply(lambda x: taxid2name[int(x)])
-        red_df['sum'] = df.sum(axis=1).values
-        red_df['clade'] = red_df.taxid.apply(lambda x: taxid2levelname[x])
-        red_df['clade'] = red_df.clade.apply(lambda x: 'NA' if x == None else x)
-    elif all(s.startswith('ncbi') for s in df.columns):
-        red_df['gene'] = df.index
-        red_df['sum'] = df.sum(axis=1).values
+        labels['taxid'] = taxids4download
+        labels['species'] = labels.taxid.apply(lambda x: taxid2name[x])
+        labels['sum'] = df.sum(axis=1).values
+        labels['clade'] = labels.taxid.apply(lambda x: taxid2levelname[x])
+        labels['clade'] = labels.clade.apply(lambda x: 'NA' if x == None else x)
+    elif pd.api.types.is_integer_dtype(df.columns):
+        labels['gene'] = df.index
+        labels['sum'] = df.sum(axis=1).values
+    return labels
+
+
+def add_jitter(red_df, jitter, seed):
+    np.random.seed(seed=seed)
+    x_jitter = np.random.normal(loc=0, scale=jitter, size=red_df['PC1'].size)
+    y_jitter = np.random.normal(loc=0, scale=jitter, size=red_df['PC2'].size)
+    red_df['PC1'] = red_df['PC1'] + x_jitter
+    red_df['PC2'] = red_df['PC2'] + y_jitter
+    return red_df
+
+
+def dimension_reduced_phyloprofile(
+    df, taxlevel, ncbi,
+    update_taxonomy, method, jitter, scaler, transpose, seed, n_components=2, deduplicate=False, decimals=None,
+    **kwargs
+):
+    """
+    Take a 2D representation of a phylogenetic profile and apply dimensionality reduction
+    deduplicate: bool -> Reduce only the unique (scaled) row patterns and give identical rows the coordinates of their pattern.
+        Exact for PCA (weighted by multiplicity), an approximation for tSNE, MDS and umap
+    decimals: int -> Round scaled values to decimals before finding unique patterns (only with deduplicate)
+    """
+    # Standardize the features
+    if transpose:
+        df = df.transpose()
+    scaled_data = scale_matrix(df, scaler)
+
+    # reduce dimensions
+    result = reduce_dimensions(scaled_data, method, seed, n_components=n_components, deduplicate=deduplicate, decimals=decimals)
+        
+    # store result in dataframe
+    red_df = pd.DataFrame(data=result, columns=[f'PC{i}' for i in range(1, n_components+1)])
+    red_df = pd.concat([red_df, embedding_labels(df, taxlevel, ncbi, update_taxonomy)], axis=1)
 
     # add jitter
     if jitter:#
-        np.random.seed(seed=seed)
-        x_jitter = np.random.normal(loc=0, scale=jitter, size=red_df['PC1'].size)
-        y_jitter = np.random.normal(loc=0, scale=jitter, size=red_df['PC2'].size)
-        red_df['PC1'] = red_df['PC1'] + x_jitter
-        red_df['PC2'] = red_df['PC2'] + y_jitter
+        red_df = add_jitter(red_df, jitter, seed)
 
     return red_df
 
 
+# scaled matrices of an embedding grid, sent once to each worker process
+_GRID_DATA = {}
+
+
+def _init_grid_worker(data, threads):
+    """Limit the threads of the numerical libraries in a worker of an embedding grid and store the scaled matrices"""
+    import os
+    for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMBA_NUM_THREADS']:
+        os.environ[variable] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads)
+    except ImportError:
+        pass
+    _GRID_DATA.clear()
+    _GRID_DATA.update(data)
+
+
+def _grid_member(scaler, method, seed, n_components, deduplicate, decimals):
+    """Compute one embedding of a grid. Module-level so that it can be sent to worker processes."""
+    return reduce_dimensions(_GRID_DATA[scaler], method, seed, n_components=n_components, deduplicate=deduplicate, decimals=decimals)
+
+
+def embedding_grid(
+    df, taxlevel, ncbi, methods, scalers, seeds, transpose, update_taxonomy=False, jitter=0.0, n_components=2,
+    deduplicate=False, decimals=None, workers=None, threads=1,
+):
+    """
+    Compute the embeddings of all combinations of methods, scalers and seeds. The matrix is transposed, labelled and
+    scaled once (per scaler); the reductions run in a pool of worker processes with threads threads each.
+    Returns a tidy DataFrame with one row per embedded gene/taxon and embedding, with the columns method, scaler, seed,
+    PC1..PCn and the labels of dimension_reduced_phyloprofile. PCA does not depend on the seed and is computed once per scaler.
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    logger = logging.getLogger('phyloprofile')
+    if transpose:
+        df = df.transpose()
+    labels = embedding_labels(df, taxlevel, ncbi, update_taxonomy)
+    data = {scaler: scale_matrix(df, scaler) for scaler in dict.fromkeys(scalers)}
+
+    seeds, members = list(dict.fromkeys(seeds)), []
+    for method in dict.fromkeys(methods):
+        for scaler in data:
+            for seed in (seeds[:1] if method == 'PCA' else seeds):
+                members.append((scaler, method, seed))
+    workers = min(workers or os.cpu_count(), len(members))
+    logger.info(f'Computing {len(members)} embeddings with {workers} workers')
+
+    if workers <= 1:
+        results = [reduce_dimensions(data[scaler], method, seed, n_components, deduplicate, decimals) for scaler, method, seed in members]
+    else:
+        # the slowest methods are started first
+        cost = {'PCA': 1}
+        order = sorted(range(len(members)), key=lambda i: cost.get(members[i][1], 0))
+        args = [(*members[i], n_components, deduplicate, decimals) for i in order]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_grid_worker, initargs=(data, threads)) as executor:
+            computed = list(executor.map(_grid_member, *zip(*args)))
+        results = [None] * len(members)
+        for i, result in zip(order, computed):
+            results[i] = result
+
+    frames = []
+    for (scaler, method, seed), result in zip(members, results):
+        red_df = pd.DataFrame(data=result, columns=[f'PC{i}' for i in range(1, result.shape[1] + 1)])
+        if jitter:
+            red_df = add_jitter(red_df, jitter, seed)
+        red_df.insert(0, 'seed', seed)
+        red_df.insert(0, 'scaler', scaler)
+        red_df.insert(0, 'method', method)
+        frames.append(pd.concat([red_df, labels], axis=1))
+    return pd.concat(frames, ignore_index=True)
+
+
 def plot_tsne(
     red_df, method='tSNE', width=1000, height=1000, **kwargs
     
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from PhyloProPy.indexing import taxon_to_int
+
+
+def gene_statistics(matrix, counts, numeric=True):
+    """
+    Per-gene statistics of a profile: number of taxa with orthologs, number of orthologs (including co-orthologs)
+    and, for numeric matrices, the mean and maximum value over the taxa with orthologs.
+    counts: DataFrame -> Number of orthologs per cell (see count_orthologs)
+    """
+    index, columns, counts = counts.index, counts.columns, counts.to_numpy()
+    stats = pd.DataFrame({'taxa': (counts > 0).sum(axis=1), 'orthologs': counts.sum(axis=1)}, index=index)
+    if numeric:
+        values = np.where(counts > 0, matrix.reindex(index=index, columns=columns).to_numpy(dtype=float), np.nan)
+        with np.errstate(invalid='ignore'):
+            stats['mean'] = np.nanmean(values, axis=1) if values.shape[1] else np.nan
+            stats['max'] = np.nanmax(values, axis=1) if values.shape[1] else np.nan
+    return stats
+
+
+def collapse_matrix(matrix, taxid2group, how='max'):
+    """
+    Collapse the taxon columns of a numeric matrix to groups (e.g. the phyla of the taxa), given as taxid -> group taxid.
+    how: ['max', 'mean', 'sum', 'fraction'] -> Aggregate of the values of the taxa in a group. 'fraction' is the fraction of taxa with a value > 0
+    Taxa without a group are dropped. Group columns are labelled like taxon columns (by taxid).
+    """
+    columns = [taxon for taxon in matrix.columns if taxon_to_int(taxon) in taxid2group]
+    groups = [taxid2group[taxon_to_int(taxon)] for taxon in columns]
+    values = matrix[columns].T
+    if how == 'fraction':
+        values = values > 0
+        how = 'mean'
+    if how not in ['max', 'mean', 'sum']:
+        raise ValueError(f'Unknown aggregation "{how}". Choose "max", "mean", "sum" or "fraction"')
+    return values.groupby(groups, sort=False).agg(how).T
@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+
+
+class LoadCancelled(Exception):
+    """Raised by a scan or load that was cancelled with its CancelToken"""
+
+
+class CancelToken():
+    """
+    Cooperative cancellation of scans and loads. Call cancel() from any thread (or from a progress callback);
+    the load stops with LoadCancelled at its next checkpoint, at the latest after the current block of records.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise LoadCancelled('Loading was cancelled')
+
+
+class LoadProgress():
+    """
+    Report the progress of reading a phyloprofile file to a callback. The callback receives a dict with
+    stage: str -> 'read' while records are read, then the next stage of the load (e.g. 'matrix', 'done')
+    bytes: int -> Bytes of the (compressed) file read so far
+    total_bytes: int -> Size of the file
+    records: int -> Ortholog records read so far
+    elapsed: float -> Seconds since the start
+    bytes_per_second, records_per_second: float -> Throughput
+    eta: float -> Estimated seconds until the file is read, None if unknown
+    """
+    def __init__(self, path, callback=None, cancel=None):
+        self.callback = callback
+        self.cancel = cancel
+        self.total_bytes = os.path.getsize(path) if not hasattr(path, 'read') and os.path.isfile(path) else None
+        self.handle = None
+        self.records = 0
+        self.start = time.perf_counter()
+
+    def attach(self, handle):
+        """Follow the position of the binary handle the file is read from"""
+        self.handle = handle
+
+    def bytes_read(self):
+        if self.handle is None or self.handle.closed:
+            return self.total_bytes or 0
+        return self.handle.tell()
+
+    def update(self, records=0, stage='read'):
+        """Count newly read records, report them and stop if the load was cancelled"""
+        self.check()
+        self.records += records
+        if self.callback is None:
+            return
+        elapsed = time.perf_counter() - self.start
+        done = self.bytes_read() if stage == 'read' else self.total_bytes or self.bytes_read()
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total_bytes and rate > 0:
+            eta = max(self.total_bytes - done, 0) / rate
+        self.callback({
+            'stage': stage,
+            'bytes': done,
+            'total_bytes': self.total_bytes,
+            'records': self.records,
+            'elapsed': elapsed,
+            'bytes_per_second': rate,
+            'records_per_second': self.records / elapsed if elapsed > 0 else 0.0,
+            'eta': eta if stage == 'read' else 0.0,
+        })
+        # the callback may have cancelled the load
+        self.check()
+
+    def check(self):
+        if self.cancel is not None:
+            self.cancel.raise_if_cancelled()
@@ -0,0 +1,148 @@
+import csv
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+from PhyloProPy.compression import open_text
+from PhyloProPy.progress import LoadProgress
+
+
+STYLES = ['fasf', 'fasb', 'ncRNA', 'binary', 'orthoid']
+
+# bytes per matrix cell for each style: float32 scores, uint8 presence/absence and int32 cell codes ('orthoid' with compact=True)
+MATRIX_ITEMSIZE = {'fasf': 4, 'fasb': 4, 'ncRNA': 4, 'binary': 1, 'orthoid': 4}
+
+# approximate sizes of CPython objects on 64 bit platforms
+PY_STR, PY_FLOAT, PY_TUPLE3, PY_LIST, POINTER = 49, 24, 64, 56, 8
+
+
+def estimate_memory(records, genes, taxa, cells, gene_chars, taxon_chars, ortho_chars, partitions=16, workers=None):
+    """
+    Project the memory of loading a profile with each style, in bytes. Returns a DataFrame with one row per style and
+    the resident size after loading and the peak while loading with the pandas backend, and the peak of the
+    partitioned backend (workers partitions in memory at once).
+    """
+    workers = workers or os.cpu_count()
+    # records table while reading: three string objects, three pointers and two floats per record
+    table = records * (3 * PY_STR + 3 * POINTER + 2 * 8) + gene_chars + taxon_chars + ortho_chars
+    # outmatrix: one pointer per cell, a list per non-empty cell, a tuple of orthoID and scores per record
+    outmatrix = genes * taxa * POINTER + cells * PY_LIST + records * (POINTER + PY_TUPLE3 + 2 * PY_FLOAT + PY_STR) + ortho_chars
+    # compact orthoID store: offset, species code and raw flag per record, the two FAS scores and the strings. It replaces the outmatrix
+    store = records * (8 + 4 + 1 + 2 * 8) + ortho_chars
+    rows = []
+    for style in STYLES:
+        matrix = genes * taxa * MATRIX_ITEMSIZE[style]
+        resident = matrix + (store if style == 'orthoid' else outmatrix)
+        # the records table and the flat cell keys of the pivots exist next to the matrices during the load
+        peak = resident + table + records * 8 * 2
+        rows.append([resident, peak, min(workers, partitions) * peak / partitions])
+    df = pd.DataFrame(rows, index=STYLES, columns=['pandas_resident', 'pandas_peak', 'partitioned_peak'])
+    return df.round().astype(np.int64)
+
+
+class ProfileScan():
+    """
+    Result of a pre-scan of a phyloprofile file.
+    records, genes, taxa: int -> Numbers of ortholog records, genes and taxa
+    cells: int -> Number of gene x taxon cells with at least one ortholog
+    coortholog_rate: float -> Fraction of records that are additional co-orthologs in an already filled cell
+    exact: bool -> False if only a sample of the file was read. The numbers are then extrapolated from the sample
+    memory: DataFrame -> Projected memory in bytes per style and backend (see estimate_memory)
+    """
+    def __init__(self, path, records, gene_ids, taxon_ids, cells, sample, chars, bytes_read, total_bytes, elapsed, partitions=16, workers=None):
+        self.path = path
+        self.exact = not total_bytes or bytes_read >= total_bytes
+        scale = 1.0 if self.exact else total_bytes / max(bytes_read, 1)
+        self.records = int(round(records * scale))
+        if self.exact:
+            self.genes, self.taxa, self.cells = len(gene_ids), len(taxon_ids), len(cells)
+        else:
+            # the cell keys of the sampled records hold the gene id in the high and the taxon id in the low bits
+            self.genes = extrapolate(sample >> 32, self.records)
+            self.taxa = extrapolate(sample & 0xFFFFFFFF, self.records)
+            self.cells = extrapolate(sample, self.records)
+        self.coortholog_rate = 1 - self.cells / self.records if self.records else 0.0
+        self.bytes = total_bytes
+        self.elapsed = elapsed
+        self.memory = estimate_memory(
+            self.records, self.genes, self.taxa, self.cells, *[c * scale for c in chars], partitions=partitions, workers=workers
+        )
+
+    def __repr__(self):
+        estimated = '' if self.exact else ', estimated from a sample'
+        peak = ', '.join(f'{style}={size / 2 ** 30:.2f}GiB' for style, size in self.memory.pandas_peak.items())
+        return (
+            f'ProfileScan(records={self.records}, genes={self.genes}, taxa={self.taxa}, coortholog_rate={self.coortholog_rate:.3f}'
+            f'{estimated}; peak memory: {peak})'
+        )
+
+
+def scan_phyloprofile(path, from_custom=False, threads=1, sample_mb=None, chunksize=1000000, partitions=16, workers=None, progress=None, cancel=None):
+    """
+    Count the records, genes, taxa and co-orthologs of a phyloprofile file without loading it, and project the memory
+    that loading it would take. Only the label columns are parsed.
+    sample_mb: float -> Stop after this many megabytes of the (compressed) file and extrapolate. Reads the whole file by default
+    partitions, workers: int -> Settings of the partitioned backend for its memory projection
+    progress: callable -> Called with a dict of the progress after every block of chunksize records (see LoadProgress)
+    cancel: CancelToken -> Stops the scan with LoadCancelled at the next block
+    """
+    logger = logging.getLogger('phyloprofile')
+    logger.info(f'Scanning {path}')
+    gene_idx, taxa_idx, ortho_idx = (0, 3, 1) if from_custom else (0, 1, 2)
+    usecols = sorted([gene_idx, taxa_idx, ortho_idx])
+    tracker = LoadProgress(path, progress, cancel)
+    gene_ids, taxon_ids, keys = {}, {}, []
+    chars = np.zeros(3)
+
+    with open(path, 'rb') as raw, open_text(raw, threads=threads) as fh:
+        tracker.attach(raw)
+        tracker.check()
+        reader = pd.read_csv(
+            fh, sep='\t', header=None, skiprows=1, usecols=usecols, index_col=False,
+            dtype=str, na_filter=False, quoting=csv.QUOTE_NONE, chunksize=chunksize,
+        )
+        for chunk in reader:
+            genes = _global_codes(chunk[gene_idx], gene_ids, chars, 0)
+            taxa = _global_codes(chunk[taxa_idx], taxon_ids, chars, 1)
+            # cells as gene id (high bits) and taxon id (low bits). A sample keeps the key of every record for extrapolation
+            cells = (genes << 32) | taxa
+            keys.append(cells if sample_mb is not None else pd.unique(cells))
+            orthoids = chunk[ortho_idx]
+            chars[2] += orthoids.iloc[:10000].str.len().mean() * len(orthoids) if len(orthoids) else 0
+            tracker.update(len(chunk))
+            if sample_mb is not None and raw.tell() >= sample_mb * 2 ** 20:
+                break
+        bytes_read = raw.tell()
+
+    sample = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+    return ProfileScan(
+        path, tracker.records, gene_ids, taxon_ids, pd.unique(sample), sample, chars, bytes_read, tracker.total_bytes,
+        time.perf_counter() - tracker.start, partitions=partitions, workers=workers,
+    )
+
+
+def _global_codes(labels, label2id, chars, column):
+    """Map labels to ids that are stable over all blocks of a file (in order of first appearance) and count the characters of new labels"""
+    codes, uniques = pd.factorize(labels)
+    ids = np.empty(len(uniques), dtype=np.int64)
+    for i, label in enumerate(uniques):
+        if label not in label2id:
+            label2id[label] = len(label2id)
+        ids[i] = label2id[label]
+    chars[column] += np.bincount(codes, minlength=len(uniques)) @ np.fromiter(map(len, uniques), dtype=np.int64, count=len(uniques))
+    return ids[codes]
+
+
+def extrapolate(ids, total):
+    """
+    Extrapolate the number of distinct values from ids in order of first appearance (a sample of total records). New
+    values in the second half of the sample are assumed to keep appearing at the same rate, so labels that are sorted
+    (all orthologs of a gene in a block) grow linearly and labels that are spread over the file saturate.
+    """
+    n = len(ids)
+    if n == 0 or total <= n:
+        return n and len(pd.unique(ids))
+    seen = len(pd.unique(ids))
+    half = len(pd.unique(ids[:n // 2]))
+    return int(round(seen + (seen - half) / (n - n // 2) * (total - n)))
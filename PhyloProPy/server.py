@@ -0,0 +1,404 @@
+import argparse
+import asyncio
+import collections
+import http.client
+import json
+import logging
+import socket
+import struct
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from PhyloProPy.PhyloProfile import PhyloProfile
+from PhyloProPy.arrow import list_cells, matrix_to_arrow, taxon_columns
+from PhyloProPy.logger import phyloprofile_logger
+from PhyloProPy.taxonomy import TaxonomySnapshot
+
+
+CONTENT_TYPE = 'application/vnd.phyloprofile.frames'
+KIND_KEY = b'phyloprofile.kind'
+METHODS = ['slice', 'lineage_slice', 'taxa', 'genes', 'gene_stats', 'collapse', 'lineage_stats', 'query', 'similar']
+# methods that return a part of the matrix, which holds orthoID codes for compact orthoID profiles
+SUBMATRIX_METHODS = ['slice', 'lineage_slice']
+FRAME = struct.Struct('>BQ')
+OK, ERROR = 0, 1
+
+
+class ThreadLocalTaxonomy():
+    """
+    Give every thread its own taxonomy object. The sqlite connection of ete3's NCBITaxa can only be used by the
+    thread that opened it, but queries of the server run in a pool of threads. Taxonomy snapshots are shared as they are.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        if not hasattr(self._local, 'ncbi'):
+            self._local.ncbi = self._factory()
+        return getattr(self._local.ncbi, name)
+
+
+def encode_result(result, style):
+    """Serialize the result of a query as an Arrow IPC stream. The kind of result is stored in the schema metadata."""
+    import pyarrow as pa
+
+    if isinstance(result, pd.Series):
+        kind, result = 'series', result.to_frame()
+    elif isinstance(result, pd.DataFrame):
+        kind = 'frame'
+    else:
+        kind = 'index' if isinstance(result, pd.Index) else 'list'
+        result = pd.DataFrame({'value': list(result)})
+    table = matrix_to_arrow(result, style)
+    table = table.replace_schema_metadata({**table.schema.metadata, KIND_KEY: kind.encode()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_result(payload):
+    """Turn an Arrow IPC stream written by encode_result back into a DataFrame, Series, Index or list"""
+    import pyarrow as pa
+
+    table = pa.ipc.open_stream(pa.py_buffer(payload)).read_all()
+    kind = table.schema.metadata.get(KIND_KEY, b'frame').decode()
+    if kind in ['frame', 'series']:
+        # one consolidated block, results are small compared to the profiles and split blocks are slow for wide frames
+        df = table.drop_columns(['geneID']).to_pandas()
+        df.index = pd.Index(table.column('geneID').to_pylist(), dtype=object)
+        df.columns = taxon_columns(df.columns)
+        if kind == 'series':
+            return df.iloc[:, 0]
+        return list_cells(df)
+    values = table.column('value').to_pylist()
+    return pd.Index(values) if kind == 'index' else values
+
+
+def pack_frames(payloads):
+    """Concatenate (status, bytes) results into one response body: one byte status and eight bytes length per frame"""
+    return b''.join(FRAME.pack(status, len(payload)) + payload for status, payload in payloads)
+
+
+def unpack_frames(body):
+    """Split a response body into (status, bytes) frames"""
+    frames, offset = [], 0
+    while offset < len(body):
+        status, length = FRAME.unpack_from(body, offset)
+        offset += FRAME.size
+        frames.append((status, body[offset:offset + length]))
+        offset += length
+    return frames
+
+
+class ProfileServer():
+    """
+    Local HTTP server that keeps PhyloProfiles loaded in memory and answers queries of many clients concurrently.
+    A request holds a batch of queries, which run in a pool of threads. Results are sent as Arrow IPC streams and
+    kept in a cache of serialized results. Identical queries that arrive while one is running wait for its result.
+    The served profiles are read-only, so cached results stay valid.
+    """
+    def __init__(self, profiles, host='127.0.0.1', port=8765, workers=4, cache_mb=512, **load_args):
+        """
+        profiles: dict -> Profile names mapped to PhyloProfile objects or phyloprofile paths
+        host: str -> Interface to listen on. Keep the default to only accept connections from this machine
+        port: int -> Port to listen on. 0 picks a free port
+        workers: int -> Number of threads that run queries
+        cache_mb: int -> Size of the result cache in megabytes. 0 disables the cache
+        load_args: -> Arguments of PhyloProfile for profiles given as paths
+        """
+        logger = logging.getLogger('phyloprofile')
+        self.profiles = {}
+        for name, profile in profiles.items():
+            if not isinstance(profile, PhyloProfile):
+                logger.info(f'Loading profile "{name}" from {profile}')
+                profile = PhyloProfile(profile, **load_args)
+            if profile.ncbi is not None and not isinstance(profile.ncbi, (ThreadLocalTaxonomy, TaxonomySnapshot)):
+                profile.ncbi = ThreadLocalTaxonomy(type(profile.ncbi))
+            self.profiles[name] = profile
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.cache_bytes = cache_mb * 2 ** 20
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self._running = {}
+        self._connections = set()
+        self._executor = None
+        self._server = None
+        self._loop = None
+        self._task = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def info(self):
+        """Names, styles and shapes of the served profiles"""
+        return {name: {'style': pp.style, 'genes': len(pp.genes()), 'taxa': len(pp.taxa())} for name, pp in self.profiles.items()}
+
+    def _run(self, name, method, kwargs):
+        """Run one query on a profile (in a worker thread) and serialize the result"""
+        if name not in self.profiles:
+            raise ValueError(f'Unknown profile "{name}". Choose "' + '", "'.join(self.profiles) + '"')
+        if method not in METHODS:
+            raise ValueError(f'Unknown method "{method}". Choose "' + '", "'.join(METHODS) + '"')
+        pp = self.profiles[name]
+        result = getattr(pp, method)(**kwargs)
+        if result is None:
+            raise ValueError(f'Query "{method}" returned no result')
+        if method in SUBMATRIX_METHODS and pp.style == 'orthoid' and pp.orthoids is not None:
+            result = pp.orthoids.to_lists(result)
+        return encode_result(result, pp.style)
+
+    async def _query(self, query):
+        """Answer one query from the cache, from an identical running query or by running it. Returns (status, bytes)."""
+        try:
+            key = json.dumps([query['profile'], query['method'], query.get('kwargs', {})], sort_keys=True)
+        except (KeyError, TypeError) as e:
+            return ERROR, f'Invalid query: {e!r}'.encode()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return OK, self._cache[key]
+        if key not in self._running:
+            loop = asyncio.get_running_loop()
+            self._running[key] = loop.run_in_executor(self._executor, self._run, query['profile'], query['method'], query.get('kwargs', {}))
+        future = self._running[key]
+        try:
+            payload = await asyncio.shield(future)
+        except Exception as e:
+            return ERROR, f'{type(e).__name__}: {e}'.encode()
+        finally:
+            if self._running.get(key) is future:
+                del self._running[key]
+        self._store(key, payload)
+        return OK, payload
+
+    def _store(self, key, payload):
+        """Add a serialized result to the cache and evict the least recently used results beyond its size"""
+        if key in self._cache or len(payload) > self.cache_bytes:
+            return
+        self._cache[key] = payload
+        self._cached_bytes += len(payload)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    async def _handle(self, reader, writer):
+        """Serve the HTTP/1.1 requests of one connection (kept alive until the client closes it)"""
+        self._connections.add(asyncio.current_task())
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, b'Malformed request line', 'text/plain')
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    field, _, value = line.decode('latin-1').partition(':')
+                    headers[field.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'GET' and target == '/profiles':
+                    await self._respond(writer, 200, json.dumps(self.info()).encode(), 'application/json')
+                elif method == 'POST' and target == '/query':
+                    try:
+                        queries = json.loads(body)['queries']
+                    except (ValueError, KeyError, TypeError):
+                        await self._respond(writer, 400, b'Expected a JSON object with a list of "queries"', 'text/plain')
+                        continue
+                    results = await asyncio.gather(*[self._query(query) for query in queries])
+                    await self._respond(writer, 200, pack_frames(results), CONTENT_TYPE)
+                else:
+                    await self._respond(writer, 404, f'Unknown endpoint {method} {target}'.encode(), 'text/plain')
+                if headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, body, content_type):
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}[status]
+        writer.write(
+            f'HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def serve(self):
+        """Run the server until it is cancelled or stopped"""
+        logger = logging.getLogger('phyloprofile')
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f'Serving {len(self.profiles)} profiles on http://{self.host}:{self.port}')
+        self._ready.set()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # close kept-alive connections
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            self._executor.shutdown(wait=False)
+
+    def start(self):
+        """Run the server in a background thread, e.g. from a notebook. Returns when it accepts connections."""
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._task = self._loop.create_task(self.serve())
+            self._loop.run_until_complete(self._task)
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        while not self._ready.wait(0.05):
+            if not self._thread.is_alive():
+                raise RuntimeError('The profile server could not be started')
+        return self
+
+    def stop(self):
+        """Stop a server started with start()"""
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+            self._thread.join()
+            self._thread = None
+            self._ready.clear()
+
+
+class ProfileClient():
+    """
+    Access a profile of a ProfileServer with the query methods of PhyloProfile. Many queries can be sent in one
+    request with batch().
+    """
+    def __init__(self, profile, host='127.0.0.1', port=8765, timeout=None):
+        self.profile = profile
+        self.host = host
+        self.port = port
+        self._connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _connect(self):
+        if self._connection.sock is None:
+            self._connection.connect()
+            self._connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            try:
+                self._connect()
+                self._connection.request(method, path, body=body, headers=headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the server closed the kept-alive connection, reconnect once
+                self._connection.close()
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f'Profile server answered {response.status}: {data.decode(errors="replace")}')
+        return data
+
+    def profiles(self):
+        """Names, styles and shapes of the profiles of the server"""
+        return json.loads(self._request('GET', '/profiles'))
+
+    def batch(self, queries):
+        """
+        Run several queries in one request. The server runs them concurrently.
+        queries: list -> (method, kwargs) tuples, e.g. [('slice', {'genes': ['g1']}), ('query', {'present_in': 'Metazoa'})]
+        """
+        body = json.dumps({'queries': [{'profile': self.profile, 'method': method, 'kwargs': kwargs} for method, kwargs in queries]})
+        results = []
+        for (method, _), (status, payload) in zip(queries, unpack_frames(self._request('POST', '/query', body))):
+            if status != OK:
+                raise RuntimeError(f'Query "{method}" failed on the server: {payload.decode()}')
+            results.append(decode_result(payload))
+        return results
+
+    def _call(self, method, **kwargs):
+        return self.batch([(method, kwargs)])[0]
+
+    @property
+    def matrix(self):
+        return self._call('slice')
+
+    def slice(self, genes=None, taxa=None):
+        """Return a DataFrame slice of the profile. Genes and taxa can be combined."""
+        return self._call('slice', genes=_as_json(genes), taxa=_as_json(taxa))
+
+    def lineage_slice(self, lineage):
+        """Return a DataFrame containing only taxa in lineage"""
+        return self._call('lineage_slice', lineage=_as_json(lineage))
+
+    def genes(self):
+        return self._call('genes')
+
+    def taxa(self, return_as='int'):
+        return self._call('taxa', return_as=return_as)
+
+    def gene_stats(self):
+        return self._call('gene_stats')
+
+    def collapse(self, rank='phylum', how='max'):
+        return self._call('collapse', rank=rank, how=how)
+
+    def lineage_stats(self, lineages=None, rank=None, stat='fraction', names=False):
+        return self._call('lineage_stats', lineages=_as_json(lineages), rank=rank, stat=stat, names=names)
+
+    def query(self, present_in=None, absent_from=None, min_fraction=1.0, max_fraction=0.0):
+        return self._call('query', present_in=_as_json(present_in), absent_from=_as_json(absent_from), min_fraction=min_fraction, max_fraction=max_fraction)
+
+    def similar(self, gene, n=10):
+        return self._call('similar', gene=gene, n=n)
+
+    def close(self):
+        self._connection.close()
+
+
+def _as_json(value):
+    """Convert list-likes and numpy numbers into values that can be sent as JSON"""
+    if value is None or isinstance(value, str):
+        return value
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, (list, tuple, set, pd.Index)):
+        return [_as_json(item) for item in value]
+    return value
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Keep phyloprofiles in memory and serve queries on this machine')
+    parser.add_argument('--profile', type=str, action='append', required=True, help='Profile to serve as name=path. Can be repeated')
+    parser.add_argument('--style', type=str, default='fasf', choices=['binary', 'fasf', 'fasb', 'orthoid', 'ncRNA'], help='Style of the profiles')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=4, help='Number of threads that run queries')
+    parser.add_argument('--cache_mb', type=int, default=512, help='Size of the result cache in megabytes')
+    parser.add_argument('--threads', type=int, default=1, help='Threads for reading compressed profiles')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    phyloprofile_logger()
+    profiles = dict(profile.split('=', 1) for profile in args.profile)
+    server = ProfileServer(profiles, host=args.host, port=args.port, workers=args.workers, cache_mb=args.cache_mb, style=args.style, threads=args.threads)
+    asyncio.run(server.serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -44,7 +44,7 @@ def main():
     if args.orient == 'species':
         transpose = True
         logger.info(f'Generating labels on "{args.taxlevel}" level')
-        taxids4download = [taxid.replace('ncbi', '') for taxid in pp.matrix.columns]
+        taxids4download = pp.matrix.columns.tolist()
         taxid2name, taxid2lineage, taxid2levelname = retrieve_taxa_mapping(taxids4download, args.taxlevel, args.update_taxonomy)
     elif args.orient == 'genes':
         transpose = False
@@ -0,0 +1,107 @@
+import logging
+import numpy as np
+import pandas as pd
+from PhyloProPy.indexing import taxon_to_int
+from PhyloProPy.mapping import check_taxonomy_input
+
+
+class LineageMembership():
+    """
+    Sparse taxon x lineage membership matrix. Row i has a 1 in the column of every lineage (node of the NCBI Taxonomy)
+    that taxon i belongs to. Built once from the lineages of the taxa of a profile.
+    """
+    def __init__(self, taxa, ncbi):
+        from scipy import sparse
+
+        self.taxa = list(taxa)
+        rows, nodes = [], []
+        for row, taxon in enumerate(self.taxa):
+            lineage = ncbi.get_lineage(taxon_to_int(taxon)) or []
+            rows.extend([row] * len(lineage))
+            nodes.extend(lineage)
+        codes, lineages = pd.factorize(np.asarray(nodes, dtype=np.int64))
+        self.lineages = pd.Index(lineages)
+        self.matrix = sparse.csc_matrix(
+            (np.ones(len(codes), dtype=np.float32), (np.asarray(rows, dtype=np.int64), codes)), shape=(len(self.taxa), len(lineages))
+        )
+        self.sizes = pd.Series(np.asarray(self.matrix.sum(axis=0)).ravel().astype(np.int64), index=self.lineages)
+        node2rank = ncbi.get_rank(list(self.lineages))
+        self.ranks = pd.Series([node2rank.get(node, '') for node in self.lineages], index=self.lineages)
+        self._ncbi = ncbi
+
+    def select(self, lineages=None, rank=None):
+        """Return the lineage taxids selected by a list of lineages (names or taxids) and/or a rank. Defaults to all lineages."""
+        if lineages is None:
+            selected = self.lineages
+        else:
+            taxids = []
+            for lineage in lineages:
+                taxid = check_taxonomy_input(lineage, self._ncbi)
+                if taxid not in self.lineages:
+                    logger = logging.getLogger('phyloprofile')
+                    logger.warning(f'No taxon of the profile belongs to "{lineage}"')
+                    continue
+                taxids.append(taxid)
+            selected = pd.Index(taxids, dtype=np.int64)
+        if rank is not None:
+            selected = selected[self.ranks.loc[selected].to_numpy() == rank]
+        return selected
+
+    def names(self, lineages):
+        """Scientific names of lineage taxids"""
+        taxid2name = self._ncbi.get_taxid_translator(list(lineages))
+        return [taxid2name.get(taxid, str(taxid)) for taxid in lineages]
+
+
+class SummaryEngine():
+    """
+    Per-gene x lineage aggregates of a profile matrix. Taxon counts and score sums of all genes in all selected
+    lineages come from one sparse matrix product with the lineage membership matrix. Results are cached per
+    lineage selection; the engine belongs to one matrix object and has to be rebuilt when the matrix is replaced.
+    """
+    STATS = ['count', 'fraction', 'sum', 'mean']
+
+    def __init__(self, matrix, membership):
+        self.matrix = matrix
+        self.membership = membership
+        self._cache = {}
+        self._dense = None
+
+    def dense(self):
+        """Dense float32 presence and score arrays of the matrix (genes x taxa), built once per engine"""
+        if self._dense is None:
+            values = self.matrix.to_numpy(dtype=np.float32)
+            present = (values > 0).astype(np.float32)
+            # scores of taxa without orthologs count as 0 (fill values may be NaN)
+            scores = values if (values >= 0).all() else np.where(present > 0, values, 0).astype(np.float32)
+            self._dense = (present, scores)
+        return self._dense
+
+    def aggregate(self, lineages):
+        """Return the number of taxa with orthologs and the sum of their scores for each gene in each lineage (both genes x lineages)"""
+        key = tuple(lineages)
+        if key not in self._cache:
+            present, scores = self.dense()
+            columns = self.membership.lineages.get_indexer(lineages)
+            membership = self.membership.matrix[:, columns].T
+            self._cache[key] = (np.asarray((membership @ present.T).T), np.asarray((membership @ scores.T).T))
+        return self._cache[key]
+
+    def stats(self, lineages, stat='fraction'):
+        """
+        Return a genes x lineages DataFrame of a statistic.
+        stat: ['count', 'fraction', 'sum', 'mean'] -> Number or fraction of taxa of a lineage with orthologs, or sum or mean score over these taxa
+        """
+        if stat not in self.STATS:
+            raise ValueError(f'Unknown statistic "{stat}". Choose "count", "fraction", "sum" or "mean"')
+        counts, sums = self.aggregate(lineages)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if stat == 'count':
+                values = counts.astype(np.int64)
+            elif stat == 'fraction':
+                values = counts / self.membership.sizes.loc[lineages].to_numpy()
+            elif stat == 'sum':
+                values = sums
+            else:
+                values = sums / counts
+        return pd.DataFrame(values, index=self.matrix.index, columns=pd.Index(lineages, dtype=np.int64))
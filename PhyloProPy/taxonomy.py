@@ -0,0 +1,206 @@
+import logging
+import os
+from PhyloProPy.compression import open_text
+
+
+SNAPSHOT_HEADER = '#phyloprofile-taxonomy\t1'
+SNAPSHOT_SUFFIX = '.taxonomy.tsv.gz'
+
+
+def taxonomy_path(path):
+    """Path of the taxonomy snapshot saved next to a profile file"""
+    return f'{path}{SNAPSHOT_SUFFIX}'
+
+
+def open_taxonomy(taxonomy=None, path=''):
+    """
+    Return the taxonomy used by a profile.
+    taxonomy: None/str/object -> None uses the snapshot saved next to path if there is one and the NCBI Taxonomy of ete3 otherwise.
+        'ncbi' always uses the NCBI Taxonomy, any other string is the path of a snapshot file. Taxonomy objects are used as they are
+    """
+    logger = logging.getLogger('phyloprofile')
+    if taxonomy is None and path and not hasattr(path, 'read') and os.path.isfile(taxonomy_path(path)):
+        taxonomy = taxonomy_path(path)
+    if taxonomy is None or taxonomy == 'ncbi':
+        from ete3 import NCBITaxa
+        logger.info('Reading NCBI Taxonomy')
+        return NCBITaxa()
+    if isinstance(taxonomy, (str, os.PathLike)):
+        logger.info(f'Reading taxonomy snapshot {taxonomy}')
+        return TaxonomySnapshot.load(taxonomy)
+    return taxonomy
+
+
+class TaxonomySnapshot():
+    """
+    The part of the NCBI Taxonomy that covers the taxa of a profile: their lineages with the names and ranks of all
+    nodes. Saved as a small gzipped table and used instead of ete3's NCBITaxa, whose methods it provides for these taxa,
+    so that profiles can be loaded on machines without the NCBI Taxonomy database.
+    Names are matched against scientific names only (no synonyms).
+    """
+    def __init__(self, parents, ranks, names, taxa=()):
+        """
+        parents, ranks, names: dict -> Parent taxid, rank and scientific name of every node (the root is its own parent)
+        taxa: list -> Taxids the snapshot was extracted for (the taxa of the profile)
+        """
+        self.parents = parents
+        self.ranks = ranks
+        self.names = names
+        self.taxa = set(taxa)
+        self._name2taxids = {}
+        for taxid, name in names.items():
+            self._name2taxids.setdefault(name.lower(), []).append(taxid)
+        self._lineages = {}
+        self._children = None
+
+    @classmethod
+    def from_ncbi(cls, taxids, ncbi=None):
+        """Extract the lineages of taxids from a taxonomy (the NCBI Taxonomy of ete3 by default)"""
+        if ncbi is None:
+            from ete3 import NCBITaxa
+            ncbi = NCBITaxa()
+        taxids = [int(taxid) for taxid in taxids]
+        parents = {}
+        for taxid in taxids:
+            lineage = ncbi.get_lineage(taxid)
+            for parent, node in zip(lineage, lineage[1:]):
+                parents[node] = parent
+            parents.setdefault(lineage[0], lineage[0])
+        nodes = list(parents)
+        ranks = ncbi.get_rank(nodes)
+        names = ncbi.get_taxid_translator(nodes)
+        return cls(
+            parents,
+            {node: ranks.get(node, 'no rank') for node in nodes},
+            {node: names.get(node, str(node)) for node in nodes},
+            [taxid for taxid in taxids if taxid in parents],
+        )
+
+    def save(self, path):
+        """Write the snapshot as a table of taxid, parent, rank, name and whether the taxon belongs to the profile"""
+        with open_text(path, 'w') as of:
+            of.write(f'{SNAPSHOT_HEADER}\n')
+            for taxid, parent in self.parents.items():
+                of.write(f'{taxid}\t{parent}\t{self.ranks[taxid]}\t{self.names[taxid]}\t{int(taxid in self.taxa)}\n')
+
+    @classmethod
+    def load(cls, path):
+        """Read a snapshot written by save()"""
+        parents, ranks, names, taxa = {}, {}, {}, []
+        with open_text(path) as fh:
+            header = fh.readline().rstrip('\n')
+            if header != SNAPSHOT_HEADER:
+                raise ValueError(f'{path} is not a taxonomy snapshot')
+            for line in fh:
+                taxid, parent, rank, name, in_profile = line.rstrip('\n').split('\t')
+                taxid = int(taxid)
+                parents[taxid], ranks[taxid], names[taxid] = int(parent), rank, name
+                if in_profile == '1':
+                    taxa.append(taxid)
+        return cls(parents, ranks, names, taxa)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __contains__(self, taxid):
+        return int(taxid) in self.parents
+
+    def _resolve(self, taxon):
+        """Taxid of a taxid or scientific name"""
+        try:
+            return int(taxon)
+        except ValueError:
+            taxids = self._name2taxids.get(str(taxon).lower())
+            if not taxids:
+                raise ValueError(f'{taxon} not found!')
+            return taxids[0]
+
+    def get_lineage(self, taxid):
+        """Taxids from the root to taxid"""
+        if not taxid:
+            return None
+        taxid = int(taxid)
+        if taxid not in self._lineages:
+            if taxid not in self.parents:
+                raise ValueError(f'{taxid} taxid not found')
+            lineage = [taxid]
+            while self.parents[lineage[-1]] != lineage[-1]:
+                lineage.append(self.parents[lineage[-1]])
+            self._lineages[taxid] = lineage[::-1]
+        return list(self._lineages[taxid])
+
+    def get_lineage_translator(self, taxids):
+        return {int(taxid): self.get_lineage(taxid) for taxid in taxids if int(taxid) in self.parents}
+
+    def get_rank(self, taxids):
+        return {int(taxid): self.ranks[int(taxid)] for taxid in taxids if int(taxid) in self.ranks}
+
+    def get_taxid_translator(self, taxids):
+        return {int(taxid): self.names[int(taxid)] for taxid in taxids if int(taxid) in self.names}
+
+    def translate_to_names(self, taxids):
+        return [self.names.get(int(taxid), taxid) for taxid in taxids]
+
+    def get_name_translator(self, names):
+        name2taxids = {}
+        for name in names:
+            taxids = self._name2taxids.get(str(name).lower())
+            if taxids:
+                name2taxids[name] = list(taxids)
+        return name2taxids
+
+    def children(self, taxid):
+        if self._children is None:
+            self._children = {}
+            for node, parent in self.parents.items():
+                if node != parent:
+                    self._children.setdefault(parent, []).append(node)
+        return self._children.get(taxid, [])
+
+    def get_descendant_taxa(self, parent, intermediate_nodes=False):
+        """
+        Taxids below parent (a taxid or scientific name). Without intermediate_nodes, only the leaves of the snapshot and
+        the taxa of the profile are returned.
+        """
+        taxid = self._resolve(parent)
+        if taxid not in self.parents:
+            raise ValueError(f'taxid not found:{taxid}')
+        descendants, stack = [], list(self.children(taxid))
+        while stack:
+            node = stack.pop()
+            children = self.children(node)
+            if intermediate_nodes or not children or node in self.taxa:
+                descendants.append(node)
+            stack.extend(children)
+        return descendants if descendants else [taxid]
+
+    def get_topology(self, taxids, intermediate_nodes=False, annotate=True):
+        """Minimal ete3 tree of the lineages of taxids, with nodes named by taxid. Single-child nodes are removed unless intermediate_nodes."""
+        from ete3 import PhyloTree
+
+        taxids = {int(taxid) for taxid in taxids}
+        nodes = {}
+        for taxid in sorted(taxids):
+            parent = None
+            for node in self.get_lineage(taxid):
+                if node not in nodes:
+                    nodes[node] = PhyloTree(name=str(node))
+                    nodes[node].add_features(taxid=node, rank=self.ranks[node])
+                    if parent is not None:
+                        parent.add_child(nodes[node])
+                parent = nodes[node]
+        if not nodes:
+            return PhyloTree()
+        root = nodes[self.get_lineage(next(iter(taxids)))[0]]
+        if not intermediate_nodes:
+            for node in root.get_descendants():
+                if len(node.children) == 1 and int(node.name) not in taxids:
+                    node.delete(prevent_nondicotomic=False)
+        tree = root.children[0].detach() if len(root.children) == 1 else root
+        if annotate:
+            for node in tree.traverse():
+                node.add_features(sci_name=self.names[int(node.name)])
+        return tree
+
+    def update_taxonomy_database(self):
+        raise ValueError('A taxonomy snapshot cannot be updated. Extract a new one from an updated NCBI Taxonomy')
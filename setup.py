@@ -16,7 +16,13 @@ setup(
         'seaborn',
         'matplotlib',
     ],
+    extras_require={
+        'compression': ['zstandard', 'biopython', 'isal'],
+        'arrow': ['pyarrow'],
+        'dask': ['dask'],
+        'server': ['pyarrow'],
+    },
     entry_points={
-        'console_scripts': ["phyloSNE = PhyloProPy.standalone_tsne:main"],
+        'console_scripts': ["phyloSNE = PhyloProPy.standalone_tsne:main", "phyloServe = PhyloProPy.server:main"],
     },
 )
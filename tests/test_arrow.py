@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+from PhyloProPy.PhyloProfile import PhyloProfile
+from PhyloProPy.taxonomy import TaxonomySnapshot
+
+
+RECORDS = [
+    ('g1', 'ncbi1', 'g1|SPA@1@1|p1|1', '0.9', '0.8'),
+    ('g1', 'ncbi1', 'g1|SPA@1@1|p2|0', '0.5', '0.5'),
+    ('g1', 'ncbi3', 'g1|SPC@3@1|p3|1', '0.4', '0.6'),
+    ('g2', 'ncbi2', 'g2|SPB@2@1|p4|1', '0.7', '0.2'),
+    ('g3', 'ncbi3', 'g3|SPC@3@1|p5|1', '0.3', '0.1'),
+]
+TAXONOMY = TaxonomySnapshot({100: 100, 1: 100, 2: 100, 3: 100}, {}, {100: 'root'})
+
+
+@pytest.fixture
+def profile(tmp_path):
+    path = tmp_path / 'profile.phyloprofile'
+    lines = ['geneID\tncbiID\torthoID\tFAS_F\tFAS_B'] + ['\t'.join(record) for record in RECORDS]
+    path.write_text('\n'.join(lines) + '\n')
+    return PhyloProfile(str(path), style='fasf', taxonomy=TAXONOMY, silent=True)
+
+
+def test_from_arrow_without_records_has_no_orthologs(profile, tmp_path):
+    pp = PhyloProfile.from_arrow(profile.to_arrow(), taxonomy=TAXONOMY)
+    pd.testing.assert_frame_equal(pp.matrix, profile.matrix)
+    assert pp.outmatrix is None
+    with pytest.raises(ValueError, match='without ortholog records'):
+        pp.write_csv(str(tmp_path / 'out.phyloprofile'))
+    assert pp.gene_stats().taxa.tolist() == [2, 1, 1]
+    pp.filter_profile(genes=['g1'])
+    assert pp.matrix.index.tolist() == ['g1']
+
+
+def test_from_arrow_with_records_uses_the_matrix_table(profile, tmp_path):
+    matrix = profile.to_arrow()
+    pp = PhyloProfile.from_arrow(matrix, profile.to_arrow('records'), taxonomy=TAXONOMY)
+    pd.testing.assert_frame_equal(pp.matrix, profile.matrix)
+    pd.testing.assert_frame_equal(pp.outmatrix, profile.outmatrix)
+    pd.testing.assert_frame_equal(pp._records(), profile._records())
+
+
+def test_read_feather_with_an_empty_taxonomy_snapshot(profile, tmp_path):
+    path = str(tmp_path / 'profile.matrix.feather')
+    profile.write_feather(path)
+    taxonomy = TaxonomySnapshot({}, {}, {})
+    pp = PhyloProfile.read_feather(path, taxonomy=taxonomy)
+    assert pp.ncbi is taxonomy
+    pd.testing.assert_frame_equal(pp.matrix, profile.matrix)
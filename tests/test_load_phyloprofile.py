@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from PhyloProPy.load_phyloprofile import read_phyloprofile_records
+
+
+def write(path, lines):
+    path.write_text('\n'.join('\t'.join(fields) for fields in lines) + '\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('columns, fas_f, fas_b', [
+    (3, [1.0, 1.0], [1.0, 1.0]),
+    (4, [0.5, 0.3], [1.0, 1.0]),
+    (5, [0.5, 0.3], [0.2, 1.0]),
+])
+def test_missing_fas_columns_are_scored_1(tmp_path, columns, fas_f, fas_b):
+    header = ['geneID', 'ncbiID', 'orthoID', 'FAS_F', 'FAS_B']
+    lines = [['g1', 'ncbi1', 'g1|A@1@1|p1|1', '0.5', '0.2'], ['g2', 'ncbi2', 'g2|B@2@1|p2|1', '0.3', '']]
+    path = write(tmp_path / 'profile.phyloprofile', [header[:columns]] + [line[:columns] for line in lines])
+    records = read_phyloprofile_records(path)
+    assert list(records.geneID) == ['g1', 'g2']
+    assert list(records.ncbiID) == [1, 2]
+    np.testing.assert_array_equal(records.FAS_F, fas_f)
+    np.testing.assert_array_equal(records.FAS_B, fas_b)
+
+
+def test_custom_export_without_fas_b(tmp_path):
+    lines = [['geneID', 'orthoID', 'species', 'ncbiID', 'x', 'FAS_F'], ['g1', 'g1|A@1@1|p1|1', 'A', 'ncbi1', 'x', '0.5']]
+    records = read_phyloprofile_records(write(tmp_path / 'custom.tsv', lines), from_custom=True)
+    assert records[['orthoID', 'ncbiID', 'FAS_F', 'FAS_B']].values.tolist() == [['g1|A@1@1|p1|1', 1, 0.5, 1.0]]
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+from PhyloProPy.orthoids import OrthoIDStore
+
+
+def store_of(orthoids):
+    records = pd.DataFrame({'geneID': 'g1', 'ncbiID': 1, 'orthoID': orthoids, 'FAS_F': 1.0, 'FAS_B': 1.0})
+    # all orthologs in one cell
+    return OrthoIDStore.from_records(records, np.zeros(len(orthoids), dtype=np.int64), (1, 1))
+
+
+def test_orthoids_are_decoded_as_stored():
+    orthoids = ['g1|SPA@1@1|p1|1', 'g1|SPA@1@1|p2|0', 'other|SPA@1@1|p3|1', 'no_pattern', 'g1|SPÄ@1@1|pä|1', '']
+    store, codes = store_of(orthoids)
+    assert len(store) == len(orthoids)
+    assert store.orthoids(codes[0, 0]) == orthoids
+
+
+def test_long_orthoid_does_not_widen_the_store():
+    orthoids = [f'g1|SPA@1@1|p{i}|1' for i in range(1000)]
+    store, _ = store_of(orthoids)
+    long_store, codes = store_of(orthoids[:-1] + ['x' * 300])
+    assert long_store.nbytes < store.nbytes + 300 + 16
+    assert long_store.orthoids(codes[0, 0])[-1] == 'x' * 300
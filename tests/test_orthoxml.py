@@ -0,0 +1,59 @@
+import xml.etree.ElementTree as ET
+import pytest
+from PhyloProPy.PhyloProfile import PhyloProfile
+from PhyloProPy.taxonomy import TaxonomySnapshot
+
+
+RECORDS = [
+    ('g1', 'ncbi1', 'g1|SPA@1@1|p1|1', '0.9', '0.8'),
+    ('g1', 'ncbi1', 'g1|SPA@1@1|p2|0', '0.5', '0.5'),
+    ('g1', 'ncbi3', 'g1|SPC@3@1|p3|1', '0.4', '0.6'),
+    ('g2', 'ncbi2', 'g2|SPB@2@1|p4|1', '0.7', '0.2'),
+    ('g3', 'ncbi3', 'g3|SPC@3@1|p5|1', '0.3', '0.1'),
+    ('g4', 'ncbi1', 'g4|SPA@1@1|p6|1', '1.0', '1.0'),
+    ('g4', 'ncbi2', 'g4|SPB@2@1|p7|1', '0.2', '0.3'),
+]
+NS = {'o': 'http://orthoXML.org/2011/'}
+
+
+@pytest.fixture
+def profile_path(tmp_path):
+    path = tmp_path / 'profile.phyloprofile'
+    lines = ['geneID\tncbiID\torthoID\tFAS_F\tFAS_B'] + ['\t'.join(record) for record in RECORDS]
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def read_orthoxml(path):
+    """Return the orthologs as (gene, taxid, orthoID, FAS_F, FAS_B) and the gene ids of each species"""
+    root = ET.parse(path).getroot()
+    proteins, species_ids = {}, {}
+    for species in root.iterfind('o:species', NS):
+        taxid = int(species.get('NCBITaxId'))
+        for gene in species.iterfind('.//o:gene', NS):
+            proteins[gene.get('id')] = (taxid, gene.get('protId'))
+            species_ids.setdefault(taxid, []).append(int(gene.get('id')))
+    orthologs = set()
+    for group in root.iterfind('.//o:orthologGroup', NS):
+        for ref in group.iterfind('o:geneRef', NS):
+            scores = {score.get('id'): float(score.get('value')) for score in ref.iterfind('o:score', NS)}
+            orthologs.add((group.get('id'), *proteins[ref.get('id')], scores['FAS_F'], scores['FAS_B']))
+    return orthologs, species_ids
+
+
+@pytest.mark.parametrize('style, kwargs', [
+    ('fasf', {}),
+    ('orthoid', {}),
+    ('orthoid', {'compact': False}),
+    ('fasf', {'backend': 'partitioned', 'partitions': 3, 'scheduler': 'synchronous'}),
+])
+def test_write_orthoxml(profile_path, tmp_path, style, kwargs):
+    if kwargs.get('backend') == 'partitioned':
+        kwargs['workdir'] = str(tmp_path / 'parts')
+    pp = PhyloProfile(profile_path, style=style, taxonomy=TaxonomySnapshot({}, {}, {}), silent=True, **kwargs)
+    path = str(tmp_path / 'out.orthoxml')
+    pp.write_orthoxml(path, names=False)
+    orthologs, species_ids = read_orthoxml(path)
+    assert orthologs == {(gene, int(taxon[4:]), orthoid, float(fasf), float(fasb)) for gene, taxon, orthoid, fasf, fasb in RECORDS}
+    # gene ids are numbered species by species
+    assert [i for ids in species_ids.values() for i in ids] == list(range(1, len(RECORDS) + 1))
@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+from PhyloProPy.PhyloProfile import PhyloProfile
+from PhyloProPy.taxonomy import TaxonomySnapshot
+
+
+RECORDS = [
+    ('g1', 'ncbi1', 'g1|SPA@1@1|p1|1', '0.9', '0.8'),
+    ('g1', 'ncbi1', 'g1|SPA@1@1|p2|0', 'NA', 'NA'),
+    ('g1', 'ncbi2', 'g1|SPB@2@1|p3|1', 'NA', '0.5'),
+    ('g2', 'ncbi2', 'g2|SPB@2@1|p4|1', '0.7', 'NA'),
+    ('g2', 'ncbi3', 'g2|SPC@3@1|p5|1', '', ''),
+    ('g3', 'ncbi3', 'g3|SPC@3@1|p6|1', '0.4', '0.6'),
+    ('g3', 'ncbi4', 'g3|SPD@4@1|p7|1', 'NA', 'NA'),
+    ('g4', 'ncbi4', 'g4|SPD@4@1|p8|1', '0.2', '0.1'),
+    ('g5', 'ncbi5', 'g5|SPE@5@1|p9|1', '1.0', '1.0'),
+    ('g6', 'ncbi1', 'g6|SPA@1@1|p10|1', '0.3', 'NA'),
+    ('g7', 'ncbi5', 'g7|SPE@5@1|p11|1', '0.6', '0.6'),
+]
+
+
+@pytest.fixture
+def profile_path(tmp_path):
+    path = tmp_path / 'na.phyloprofile'
+    lines = ['geneID\tncbiID\torthoID\tFAS_F\tFAS_B'] + ['\t'.join(record) for record in RECORDS]
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def load(path, style, **kwargs):
+    return PhyloProfile(path, style=style, taxonomy=TaxonomySnapshot({}, {}, {}), silent=True, **kwargs)
+
+
+def sort_frame(df):
+    return df.sort_index().sort_index(axis=1)
+
+
+@pytest.mark.parametrize('style', ['fasf', 'fasb', 'binary'])
+def test_partitioned_matches_pandas_with_na_scores(profile_path, tmp_path, style):
+    pp = load(profile_path, style)
+    partitioned = load(profile_path, style, backend='partitioned', partitions=3, workdir=str(tmp_path / 'parts'), scheduler='synchronous')
+    pd.testing.assert_frame_equal(sort_frame(partitioned.matrix), sort_frame(pp.matrix))
+    pd.testing.assert_frame_equal(sort_frame(partitioned.outmatrix), sort_frame(pp.outmatrix))
+    pp.to_binary()
+    partitioned.to_binary()
+    pd.testing.assert_frame_equal(sort_frame(partitioned.matrix), sort_frame(pp.matrix))
+
+
+def test_partitioned_frames_are_kept_until_the_profile_changes(profile_path, tmp_path):
+    partitioned = load(profile_path, 'fasf', backend='partitioned', partitions=3, workdir=str(tmp_path / 'parts'), scheduler='synchronous')
+    assert partitioned.matrix is partitioned.matrix
+    assert partitioned.outmatrix is partitioned.outmatrix
+    genes = pd.Index(['g1', 'g3'])
+    pd.testing.assert_frame_equal(partitioned.slice(genes=genes), partitioned.matrix.loc[genes])
+    partitioned.filter_profile(genes=genes)
+    assert sorted(partitioned.matrix.index) == ['g1', 'g3']
+    partitioned.to_binary()
+    assert set(partitioned.matrix.to_numpy().ravel()) <= {0, 1}
+
+
+def test_partitioned_write_csv_saves_the_taxonomy(profile_path, tmp_path):
+    from PhyloProPy.taxonomy import taxonomy_path
+    taxonomy = TaxonomySnapshot({100: 100, 1: 100, 2: 100, 3: 100, 4: 100, 5: 100}, {}, {100: 'root'})
+    partitioned = PhyloProfile(profile_path, style='fasf', taxonomy=taxonomy, silent=True, backend='partitioned', partitions=3, workdir=str(tmp_path / 'parts'), scheduler='synchronous')
+    path = str(tmp_path / 'out.phyloprofile')
+    partitioned.write_csv(path, taxonomy=True)
+    snapshot = TaxonomySnapshot.load(taxonomy_path(path))
+    assert snapshot.taxa == {1, 2, 3, 4, 5}
+    load(profile_path, 'fasf').write_csv(str(tmp_path / 'pandas.phyloprofile'))
+    written = PhyloProfile(path, style='fasf', silent=True)
+    expected = load(str(tmp_path / 'pandas.phyloprofile'), 'fasf')
+    pd.testing.assert_frame_equal(sort_frame(written.matrix), sort_frame(expected.matrix))
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from scipy.cluster.hierarchy import cophenet, is_valid_linkage, leaves_list, linkage
+from scipy.spatial.distance import squareform
+from PhyloProPy.patterns import expand_order, pattern_linkage, unique_rows, weighted_pca
+
+
+METHODS = ['average', 'centroid', 'ward', 'single', 'complete', 'weighted', 'median']
+
+
+@pytest.fixture
+def rows():
+    """Rows with continuous values (no tied distances) in which every pattern occurs 1-4 times"""
+    rng = np.random.default_rng(1)
+    patterns = rng.random((60, 8))
+    return patterns[rng.permutation(np.repeat(np.arange(60), rng.integers(1, 5, 60)))]
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_pattern_linkage_matches_clustering_all_rows(rows, method):
+    patterns, inverse, counts = unique_rows(rows)
+    Z = pattern_linkage(patterns, counts, method=method)
+    full = linkage(rows, method=method)
+
+    # identical rows form the leaves of the pattern tree, above them both trees are the same
+    different = inverse[:, None] != inverse[None, :]
+    pattern_heights = cophenet(Z)
+    full_heights = cophenet(full)
+    np.testing.assert_allclose(squareform(full_heights)[different], squareform(pattern_heights)[np.ix_(inverse, inverse)][different])
+
+    # heatmap order: the rows of a pattern are adjacent and follow the leaf order of the pattern tree
+    order = inverse[expand_order(leaves_list(Z), inverse)]
+    runs = order[np.r_[True, order[1:] != order[:-1]]]
+    np.testing.assert_array_equal(runs, leaves_list(Z))
+
+def test_pattern_linkage_is_a_valid_linkage(rows):
+    patterns, _, counts = unique_rows(rows)
+    for method in METHODS:
+        Z = pattern_linkage(patterns, counts, method=method)
+        assert is_valid_linkage(Z)
+        assert Z[-1, 3] == len(patterns)
+
+
+def test_weighted_pca_matches_pca_of_all_rows(rows):
+    from sklearn.decomposition import PCA
+    patterns, inverse, counts = unique_rows(rows)
+    np.testing.assert_allclose(weighted_pca(patterns, counts)[inverse], PCA(n_components=2).fit_transform(rows), atol=1e-8)
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+from PhyloProPy.PhyloProfile import PhyloProfile
+from PhyloProPy.server import ProfileClient, ProfileServer
+from PhyloProPy.taxonomy import TaxonomySnapshot
+
+
+RECORDS = [
+    ('g1', 'ncbi1', 'g1|SPA@1@1|p1|1', '0.9', '0.8'),
+    ('g1', 'ncbi1', 'g1|SPA@1@1|p2|0', '0.5', '0.5'),
+    ('g1', 'ncbi3', 'g1|SPC@3@1|p3|1', '0.4', '0.6'),
+    ('g2', 'ncbi2', 'g2|SPB@2@1|p4|1', '0.7', '0.2'),
+    ('g3', 'ncbi3', 'g3|SPC@3@1|p5|1', '0.3', '0.1'),
+]
+# root 100 -> lineage 10 (taxa 1 and 2) and taxon 3
+TAXONOMY = TaxonomySnapshot({100: 100, 10: 100, 1: 10, 2: 10, 3: 100}, {}, {100: 'root', 10: 'lineage', 1: 'SPA', 2: 'SPB', 3: 'SPC'}, [1, 2, 3])
+
+
+@pytest.fixture
+def profile_path(tmp_path):
+    path = tmp_path / 'orthoids.phyloprofile'
+    lines = ['geneID\tncbiID\torthoID\tFAS_F\tFAS_B'] + ['\t'.join(record) for record in RECORDS]
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('compact', [True, False])
+def test_server_returns_orthoid_lists_of_submatrices(profile_path, compact):
+    pp = PhyloProfile(profile_path, style='orthoid', compact=compact, taxonomy=TAXONOMY, silent=True)
+    expected = PhyloProfile(profile_path, style='orthoid', compact=False, taxonomy=TAXONOMY, silent=True)
+    server = ProfileServer({'p': pp}, port=0).start()
+    client = ProfileClient('p', port=server.port)
+    try:
+        pd.testing.assert_frame_equal(client.slice(), expected.matrix)
+        pd.testing.assert_frame_equal(client.lineage_slice('lineage'), expected.lineage_slice('lineage'))
+        assert client.lineage_slice('lineage').loc['g2', 1] == 0
+    finally:
+        client.close()
+        server.stop()